@@ -0,0 +1,41 @@
+"""
+Guard for operator-only endpoints (/metrics, /api/admin/*).
+
+The caller sends ADMIN_TOKEN either as the X-Admin-Token header or as
+"Authorization: Bearer <token>" (what Prometheus' `authorization` scrape
+setting sends). While ADMIN_TOKEN is unset these endpoints answer 404.
+"""
+import hmac
+from functools import wraps
+
+from flask import current_app, jsonify, request
+
+ADMIN_HEADER = 'X-Admin-Token'
+
+
+def token_matches(expected, supplied):
+    """Constant-time comparison; False if either side is missing."""
+    if not expected or supplied is None:
+        return False
+    return hmac.compare_digest(expected.encode('utf-8'), supplied.encode('utf-8'))
+
+
+def supplied_token():
+    token = request.headers.get(ADMIN_HEADER)
+    if token is None:
+        auth = request.headers.get('Authorization', '')
+        if auth.startswith('Bearer '):
+            token = auth[len('Bearer '):]
+    return token
+
+
+def admin_required(f):
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        expected = current_app.config.get('ADMIN_TOKEN')
+        if not expected:
+            return jsonify({'error': 'Not found'}), 404
+        if not token_matches(expected, supplied_token()):
+            return jsonify({'error': 'Forbidden'}), 403
+        return f(*args, **kwargs)
+    return decorated
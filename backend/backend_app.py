@@ -4,49 +4,321 @@ import time
 import threading
 import json
 import datetime
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
 
-import bcrypt
-import fitz  # PyMuPDF for PDF
-import google.generativeai as genai
 import jwt
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify, Response, send_file
+from flask import Blueprint, Flask, current_app, request, jsonify, Response, send_file
 from flask_cors import CORS  # type: ignore
 from flask_mongoengine import MongoEngine
-from pptx import Presentation  # python-pptx for PowerPoint
 
-# ---------------- INITIALIZATION & CONFIG ----------------
-load_dotenv()
-
-app = Flask(__name__)
-
-CORS(app,
-     origins=[
-         "http://localhost:3000",
-         "http://127.0.0.1:3000",
-         "http://localhost:5173",
-         "http://127.0.0.1:5173"
-     ],
-     allow_headers=["Content-Type", "x-auth-token", "Authorization"],
-     supports_credentials=True,
-     methods=["GET", "POST", "PATCH", "DELETE", "OPTIONS"])
-
-app.config['MONGODB_SETTINGS'] = {
-    'db': 'mindvault_db',
-    'host': os.getenv('MONGO_URI')
-}
-app.config['JWT_SECRET'] = os.getenv('JWT_SECRET') or 'secret-dev'
-db = MongoEngine(app)
+from bson import ObjectId
+from pymongo import DeleteOne, InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+import metrics
+import page_store
+import passwords
+import storage
+import profiling
+import query_accounting
+import response_encoding
+import study_plans
+from cache import PerUserCache
+
+# NOTE: fitz (PyMuPDF), python-pptx and google.generativeai are heavy to import
+# and are only needed by the extraction / AI routes. They are imported lazily
+# (see LAZY HEAVY IMPORTS below) so that worker boot and tests stay fast.
 
+# ---------------- INITIALIZATION & CONFIG ----------------
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 MY_VAULT_FOLDER = os.path.join(BASE_DIR, "myvault_files")
-os.makedirs(MY_VAULT_FOLDER, exist_ok=True)
 
-gemini_api_key = os.getenv("GEMINI_API_KEY")
-if not gemini_api_key:
-    print("⚠️ WARNING: GEMINI_API_KEY environment variable not set.")
-genai.configure(api_key=gemini_api_key)
+db = MongoEngine()
+api = Blueprint('api', __name__)
+
+# Per-user /api/planner/alerts results; invalidated on every event / alert write.
+alerts_cache = PerUserCache('alerts', ttl=15.0)
+
+
+def create_app(config=None, start_background=None):
+    """
+    Application factory.
+
+    Nothing is connected or started at import time; everything happens here.
+    Background services (planner checker) are opt-in: pass start_background=True
+    or set MINDVAULT_BACKGROUND=1.
+    Gunicorn: gunicorn "backend_app:create_app()"
+    """
+    load_dotenv()
+
+    app = Flask(__name__)
+
+    CORS(app,
+         origins=[
+             "http://localhost:3000",
+             "http://127.0.0.1:3000",
+             "http://localhost:5173",
+             "http://127.0.0.1:5173"
+         ],
+         allow_headers=["Content-Type", "x-auth-token", "Authorization", "X-MindVault-Profile"],
+         supports_credentials=True,
+         methods=["GET", "POST", "PATCH", "DELETE", "OPTIONS"])
+
+    app.config['MONGODB_SETTINGS'] = {
+        'db': 'mindvault_db',
+        'host': os.getenv('MONGO_URI')
+    }
+    app.config['JWT_SECRET'] = os.getenv('JWT_SECRET') or 'secret-dev'
+    app.config['VAULT_FOLDER'] = MY_VAULT_FOLDER
+    # page-addressable extracted text (page_store.py), built after upload, rebuilt on demand if removed
+    app.config['DERIVED_FOLDER'] = os.getenv('DERIVED_FOLDER') or os.path.join(BASE_DIR, "derived")
+    app.config['PAGE_BUILD_WORKERS'] = int(os.getenv('PAGE_BUILD_WORKERS') or 2)
+    app.config['VAULT_STORAGE'] = os.getenv('VAULT_STORAGE') or 'local'
+    app.config['VAULT_COMPRESSION'] = os.getenv('VAULT_COMPRESSION') or 'auto'
+    app.config['VAULT_S3_BUCKET'] = os.getenv('VAULT_S3_BUCKET')
+    app.config['VAULT_S3_PREFIX'] = os.getenv('VAULT_S3_PREFIX') or ''
+    app.config['VAULT_S3_ENDPOINT'] = os.getenv('VAULT_S3_ENDPOINT')
+    # per-user storage quota in bytes (original sizes); unset = unlimited
+    app.config['VAULT_QUOTA_BYTES'] = int(os.getenv('VAULT_QUOTA_BYTES')) if os.getenv('VAULT_QUOTA_BYTES') else None
+    app.config['VAULT_STATS_RECONCILE_INTERVAL'] = int(os.getenv('VAULT_STATS_RECONCILE_INTERVAL') or 3600)
+    # deleted files stay restorable in the trash this long, then the GC purges them
+    app.config['VAULT_TRASH_RETENTION_DAYS'] = float(os.getenv('VAULT_TRASH_RETENTION_DAYS') or 30)
+    app.config['VAULT_GC_INTERVAL'] = int(os.getenv('VAULT_GC_INTERVAL') or 300)
+    app.config['VAULT_GC_BATCH_SIZE'] = int(os.getenv('VAULT_GC_BATCH_SIZE') or 100)
+    app.config['VAULT_GC_PAUSE'] = float(os.getenv('VAULT_GC_PAUSE') or 0.5)
+    app.config['PLANNER_CHECK_INTERVAL'] = 30
+    app.config['ALERTS_LOOKBACK_DAYS'] = int(os.getenv('ALERTS_LOOKBACK_DAYS') or 30)
+    # reminders (CalendarBox) are listed this far ahead; other events only within the hour
+    app.config['ALERTS_REMINDER_LOOKAHEAD_DAYS'] = int(os.getenv('ALERTS_REMINDER_LOOKAHEAD_DAYS') or 365)
+    app.config['ALERTS_PAGE_SIZE'] = 50
+    app.config['ALERTS_MAX_PAGE_SIZE'] = 200
+    app.config['PLANNER_BULK_MAX_OPS'] = 500
+    app.config['BCRYPT_ROUNDS'] = int(os.getenv('BCRYPT_ROUNDS')) if os.getenv('BCRYPT_ROUNDS') else None
+    app.config['BCRYPT_TARGET_MS'] = float(os.getenv('BCRYPT_TARGET_MS')) if os.getenv('BCRYPT_TARGET_MS') else None
+    app.config['BCRYPT_WORKERS'] = int(os.getenv('BCRYPT_WORKERS') or min(4, os.cpu_count() or 2))
+    # hashes in flight block their request threads: keep workers + pending below SERVER_THREADS
+    app.config['BCRYPT_MAX_PENDING'] = int(os.getenv('BCRYPT_MAX_PENDING') or 1)
+    app.config['BCRYPT_TIMEOUT'] = float(os.getenv('BCRYPT_TIMEOUT') or 2.0)
+    # request threads per process (gunicorn --threads); caps the bcrypt admission
+    app.config['SERVER_THREADS'] = int(os.getenv('SERVER_THREADS')) if os.getenv('SERVER_THREADS') else None
+    app.config['PLAN_CACHE_TTL_HOURS'] = int(os.getenv('PLAN_CACHE_TTL_HOURS') or 72)
+    app.config['GEMINI_MODEL_FACTORY'] = None
+    app.config['ADMIN_TOKEN'] = os.getenv('ADMIN_TOKEN')
+    app.config['PROFILE_TOKEN'] = os.getenv('PROFILE_TOKEN')
+    app.config['PROFILE_SAMPLE_RATE'] = float(os.getenv('PROFILE_SAMPLE_RATE') or 0)
+    app.config['PROFILE_SLOW_MS'] = float(os.getenv('PROFILE_SLOW_MS')) if os.getenv('PROFILE_SLOW_MS') else None
+    app.config['PROFILE_BUFFER_SIZE'] = int(os.getenv('PROFILE_BUFFER_SIZE') or 50)
+    # shared profile buffer for multi-worker servers; unset = per-process memory
+    app.config['PROFILE_DIR'] = os.getenv('PROFILE_DIR')
+    app.config['QUERY_STATS_HEADER'] = os.getenv('QUERY_STATS_HEADER', '').lower() in ('1', 'true', 'yes')
+    app.config['N_PLUS_ONE_THRESHOLD'] = int(os.getenv('N_PLUS_ONE_THRESHOLD') or 5)
+    app.config['METRICS_ENABLED'] = os.getenv('METRICS_ENABLED', '1').lower() not in ('0', 'false', 'no')
+    # pre-fork servers: a per-deployment directory, emptied on restart (see metrics.MultiprocessSpool)
+    app.config['METRICS_MULTIPROC_DIR'] = os.getenv('METRICS_MULTIPROC_DIR')
+    # bytes; set to None to disable response compression (e.g. behind a compressing proxy)
+    app.config['COMPRESS_MIN_SIZE'] = int(os.getenv('COMPRESS_MIN_SIZE') or 1024)
+    if config:
+        app.config.update(config)
+
+    # these register pymongo listeners, which must precede the MongoClient
+    metrics.init_app(app)
+    query_accounting.init_app(app)
+    profiling.init_app(app)
+    response_encoding.init_app(app)
+    db.init_app(app)
+    app.extensions['password_hasher'] = passwords.PasswordHasher(
+        rounds=app.config['BCRYPT_ROUNDS'],
+        target_ms=app.config['BCRYPT_TARGET_MS'],
+        workers=app.config['BCRYPT_WORKERS'],
+        max_pending=app.config['BCRYPT_MAX_PENDING'],
+        timeout=app.config['BCRYPT_TIMEOUT'],
+        request_threads=app.config['SERVER_THREADS'],
+    )
+    app.extensions['password_hasher'].calibrate()
+    app.extensions['vault_storage'] = storage.from_config(app.config)
+    app.extensions['page_store'] = page_store.PageStore(app.config['DERIVED_FOLDER'])
+    # threads start on first submit, so this is safe to create before a fork
+    app.extensions['page_builder'] = ThreadPoolExecutor(
+        max_workers=app.config['PAGE_BUILD_WORKERS'], thread_name_prefix='pages')
+    app.register_blueprint(api)
+
+    if start_background is None:
+        start_background = os.getenv('MINDVAULT_BACKGROUND', '').lower() in ('1', 'true', 'yes')
+    if start_background:
+        start_background_services(app)
+
+    return app
+
+
+# ---------------- LAZY HEAVY IMPORTS ----------------
+_genai = None
+_genai_lock = threading.Lock()
+
+
+def get_genai():
+    """Import and configure google.generativeai on first use."""
+    global _genai
+    if _genai is None:
+        with _genai_lock:
+            if _genai is None:
+                import google.generativeai as genai
+                gemini_api_key = os.getenv("GEMINI_API_KEY")
+                if not gemini_api_key:
+                    print("⚠️ WARNING: GEMINI_API_KEY environment variable not set.")
+                genai.configure(api_key=gemini_api_key)
+                _genai = genai
+    return _genai
+
+
+def get_model(model_name):
+    """
+    Return a model object exposing generate_content().
+    GEMINI_MODEL_FACTORY in the app config (callable taking the model name)
+    replaces the real client, e.g. with the benchmark stand-in.
+    """
+    factory = current_app.config.get('GEMINI_MODEL_FACTORY')
+    if factory is not None:
+        return factory(model_name)
+    return get_genai().GenerativeModel(model_name)
+
+
+def generate_content(model_name, prompt):
+    """Call Gemini's generate_content, recording latency and errors per model."""
+    start = time.perf_counter()
+    try:
+        response = get_model(model_name).generate_content(prompt)
+    except Exception:
+        metrics.GEMINI_REQUESTS.inc(model=model_name, outcome='error')
+        raise
+    finally:
+        metrics.GEMINI_LATENCY.observe(time.perf_counter() - start, model=model_name)
+    metrics.GEMINI_REQUESTS.inc(model=model_name, outcome='ok')
+    return response
+
+
+def stream_content(model_name, prompt):
+    """Yield text chunks from a streamed generate_content call (same metrics as above)."""
+    start = time.perf_counter()
+    try:
+        for chunk in get_model(model_name).generate_content(prompt, stream=True):
+            text = getattr(chunk, 'text', None)
+            if text:
+                yield text
+    except Exception:
+        metrics.GEMINI_REQUESTS.inc(model=model_name, outcome='error')
+        raise
+    finally:
+        metrics.GEMINI_LATENCY.observe(time.perf_counter() - start, model=model_name)
+    metrics.GEMINI_REQUESTS.inc(model=model_name, outcome='ok')
+
+
+def extract_text(path, max_pages=None, max_slides=None, max_chars=None):
+    """
+    Extract plain text from a PDF / PPT(X) / TXT file.
+    Returns None for unsupported file types.
+    """
+    pages = extract_pages(path, max_pages, max_slides, max_chars)
+    return None if pages is None else "\n".join(pages)
+
+
+def extract_pages(path, max_pages=None, max_slides=None, max_chars=None):
+    """Text per PDF page / PPT(X) slide (a TXT file is one page); None if unsupported."""
+    file_type = os.path.splitext(path)[1].lstrip('.').lower() or 'unknown'
+    size_class = metrics.size_class(os.path.getsize(path))
+    with metrics.EXTRACTION_LATENCY.time(file_type=file_type, size_class=size_class):
+        return _extract_pages(path, max_pages, max_slides, max_chars)
+
+
+def _extract_pages(path, max_pages, max_slides, max_chars):
+    if path.endswith(".pdf"):
+        import fitz  # PyMuPDF for PDF
+        with fitz.open(path) as doc:
+            page_count = doc.page_count if max_pages is None else min(max_pages, doc.page_count)
+            return [doc.load_page(i).get_text() for i in range(page_count)]
+    if path.endswith((".pptx", ".ppt")):
+        from pptx import Presentation  # python-pptx for PowerPoint
+        prs = Presentation(path)
+        slides = list(prs.slides) if max_slides is None else list(prs.slides)[:max_slides]
+        return [
+            "\n".join(shape.text for shape in slide.shapes if hasattr(shape, "text"))
+            for slide in slides
+        ]
+    if path.endswith(".txt"):
+        with open(path, "r", encoding="utf-8") as f:
+            return [f.read(max_chars) if max_chars is not None else f.read()]
+    return None
+
+def vault_storage():
+    return current_app.extensions['vault_storage']
+
+# summarize / mcqs prompts use at most this much of the file text
+PROMPT_TEXT_CHARS = 5000
+
+def file_pages(file_meta):
+    """
+    PageText (page_store.py) for a vault file. Normally built in the background
+    after upload (schedule_page_build); if it isn't there yet the whole document
+    is extracted and stored now. None if the type is unsupported.
+    """
+    store = current_app.extensions['page_store']
+    pages = store.open(file_meta.file_id)
+    if pages is not None:
+        return pages
+    return _build_pages(file_meta.file_id, file_meta.storage_path, file_meta.storage_codec)
+
+def file_text(file_meta, max_chars=PROMPT_TEXT_CHARS):
+    """The file's text from the page store, cut at max_chars; None if unsupported."""
+    pages = file_pages(file_meta)
+    if pages is None:
+        return None
+    with pages:
+        parts, size = [], 0
+        for n in range(1, pages.page_count + 1):
+            if size >= max_chars:
+                break
+            parts.append(pages.page(n))
+            size += len(parts[-1]) + 1
+    return "\n".join(parts)[:max_chars]
+
+def _build_pages(file_id, storage_path, storage_codec):
+    with vault_storage().local_path(storage_path, storage_codec) as path:
+        texts = extract_pages(path)
+    if texts is None:
+        return None
+    return current_app.extensions['page_store'].build(file_id, texts)
+
+# file_ids with a background build queued or running in this process
+_page_builds = set()
+_page_builds_lock = threading.Lock()
+
+def schedule_page_build(file_meta):
+    """Extract file_meta's pages into the page store on the page_builder pool (once at a time per file)."""
+    with _page_builds_lock:
+        if file_meta.file_id in _page_builds:
+            return
+        _page_builds.add(file_meta.file_id)
+    app = current_app._get_current_object()
+    args = (file_meta.file_id, file_meta.storage_path, file_meta.storage_codec)
+    try:
+        app.extensions['page_builder'].submit(_background_page_build, app, *args)
+    except Exception:
+        with _page_builds_lock:
+            _page_builds.discard(file_meta.file_id)
+        raise
+
+def _background_page_build(app, file_id, storage_path, storage_codec):
+    try:
+        with app.app_context():
+            pages = _build_pages(file_id, storage_path, storage_codec)
+            if pages is not None:
+                pages.close()
+    except Exception as e:
+        print(f"⚠️ page text build failed for {file_id}: {e}")
+    finally:
+        with _page_builds_lock:
+            _page_builds.discard(file_id)
 
 # ---------------- TOKEN DECORATOR ----------------
 def token_required(f):
@@ -63,7 +335,7 @@ def token_required(f):
             return jsonify({'error': 'Token is missing!'}), 401
 
         try:
-            data = jwt.decode(token, app.config['JWT_SECRET'], algorithms=["HS256"])
+            data = jwt.decode(token, current_app.config['JWT_SECRET'], algorithms=["HS256"])
             current_user = User.objects.get(id=data['user_id'])
         except Exception as e:
             return jsonify({'error': 'Token is invalid or expired!', 'details': str(e)}), 401
@@ -82,20 +354,43 @@ class File(db.Document):
     user_id = db.ReferenceField(User, required=True)
     filename = db.StringField(required=True)
     file_id = db.StringField(required=True, unique=True)
+    # storage key (see storage.py); absolute paths are pre-migration local files
     storage_path = db.StringField(required=True)
+    # codec suffix the blob was stored with ('', '.gz', '.zst'); None = probe (older records)
+    storage_codec = db.StringField()
     file_type = db.StringField()
     mime_type = db.StringField(required=True)
     size = db.IntField()
     upload_date = db.DateTimeField(default=datetime.datetime.utcnow)
+    # trash: is_deleted files are restorable until purge_at, then the GC removes them
     is_deleted = db.BooleanField(default=False)
+    deleted_at = db.DateTimeField()
+    purge_at = db.DateTimeField()
     meta = {
         'collection': 'files',
         'indexes': [
             {'fields': ('user_id', 'is_deleted')},
             {'fields': ('user_id', 'filename')},
+            # GC scan; only trashed files carry purge_at
+            {'fields': ('purge_at',), 'sparse': True},
         ]
     }
 
+# Running per-user totals over File, maintained with $inc on upload/delete
+# (reserve_vault_space / release_vault_space) and repaired by reconcile_vault_stats.
+# Trashed files stay in the totals until purged (trash_* is that part) but do not
+# count toward VAULT_QUOTA_BYTES: the UI treats delete as permanent.
+class VaultStats(db.Document):
+    user_id = db.ReferenceField(User, required=True, unique=True)
+    file_count = db.IntField(default=0)
+    total_bytes = db.IntField(default=0)
+    trash_count = db.IntField(default=0)
+    trash_bytes = db.IntField(default=0)
+    # {file_type: {'count': n, 'bytes': b}}
+    by_type = db.DictField()
+    updated_at = db.DateTimeField(default=datetime.datetime.utcnow)
+    meta = {'collection': 'vault_stats'}
+
 # NEW: FileChat - one chat per file per user (P1)
 class FileChat(db.Document):
     user_id = db.ReferenceField(User, required=True)
@@ -119,7 +414,16 @@ class PlannerTask(db.Document):
     done = db.BooleanField(default=False)
     created_at = db.DateTimeField(default=datetime.datetime.utcnow)
     updated_at = db.DateTimeField(default=datetime.datetime.utcnow)
-    meta = {'collection': 'planner_tasks'}
+    meta = {
+        'collection': 'planner_tasks',
+        'indexes': [
+            {'fields': ('user_id', 'updated_at')},
+        ]
+    }
+
+    def clean(self):
+        # every save() bumps updated_at so /api/planner/sync sees the change
+        self.updated_at = datetime.datetime.utcnow()
 
 class PlannerEvent(db.Document):
     user_id = db.ReferenceField(User, required=True)
@@ -128,7 +432,21 @@ class PlannerEvent(db.Document):
     deadline = db.DateTimeField(required=True)
     created_at = db.DateTimeField(default=datetime.datetime.utcnow)
     updated_at = db.DateTimeField(default=datetime.datetime.utcnow)
-    meta = {'collection': 'planner_events'}
+    meta = {
+        'collection': 'planner_events',
+        'indexes': [
+            # alerts: one backward range scan per user, _id as the pagination tie-break
+            {'fields': ('user_id', 'deadline', 'id')},
+            # background checker scans a deadline window across all users
+            {'fields': ('deadline',)},
+            {'fields': ('user_id', 'updated_at')},
+            # checker: events written since its last tick
+            {'fields': ('updated_at',)},
+        ]
+    }
+
+    def clean(self):
+        self.updated_at = datetime.datetime.utcnow()
 
 class Alert(db.Document):
     user_id = db.ReferenceField(User, required=True)
@@ -136,14 +454,47 @@ class Alert(db.Document):
     related_event = db.ReferenceField(PlannerEvent, null=True)
     created_at = db.DateTimeField(default=datetime.datetime.utcnow)
     read = db.BooleanField(default=False)
-    meta = {'collection': 'planner_alerts'}
+    meta = {
+        'collection': 'planner_alerts',
+        'indexes': [
+            {'fields': ('user_id', 'read')},
+            {'fields': ('related_event',)},
+        ]
+    }
+
+# Deletion markers for /api/planner/sync; expire after TOMBSTONE_RETENTION_DAYS,
+# clients with an older sync token get a full reset instead.
+TOMBSTONE_RETENTION_DAYS = 30
+
+class PlannerTombstone(db.Document):
+    user_id = db.ReferenceField(User, required=True)
+    kind = db.StringField(required=True, choices=('task', 'event'))
+    object_id = db.ObjectIdField(required=True)
+    deleted_at = db.DateTimeField(default=datetime.datetime.utcnow)
+    meta = {
+        'collection': 'planner_tombstones',
+        'indexes': [
+            {'fields': ('user_id', 'deleted_at')},
+            {'fields': ('deleted_at',), 'expireAfterSeconds': TOMBSTONE_RETENTION_DAYS * 24 * 3600},
+        ]
+    }
 
 class AIPlan(db.Document):
     user_id = db.ReferenceField(User, required=True)
     prompt = db.StringField()
     plan_text = db.StringField()
+    mode = db.StringField(default='markdown', choices=('markdown', 'structured'))
+    # structured plans: [{day, focus, tasks: [{title, details}]}]
+    days = db.ListField(db.DictField(), default=[])
+    # normalized (mode, goals, subjects, timeframe); unset for fallback plans so they are never reused
+    cache_key = db.StringField()
     created_at = db.DateTimeField(default=datetime.datetime.utcnow)
-    meta = {'collection': 'ai_plans'}
+    meta = {
+        'collection': 'ai_plans',
+        'indexes': [
+            {'fields': ('cache_key', '-created_at'), 'sparse': True},
+        ]
+    }
 
 # ---------------- HELPERS ----------------
 def parse_iso(dt_str):
@@ -152,8 +503,163 @@ def parse_iso(dt_str):
     except Exception:
         return None
 
+def invalidate_alerts(user_id):
+    alerts_cache.invalidate(str(user_id))
+
+def encode_cursor(deadline, object_id):
+    return f"{deadline.isoformat()}_{object_id}"
+
+def decode_cursor(cursor):
+    """Return (deadline, ObjectId) from encode_cursor() output, or None if malformed."""
+    try:
+        deadline, object_id = cursor.rsplit('_', 1)
+        return datetime.datetime.fromisoformat(deadline), ObjectId(object_id)
+    except Exception:
+        return None
+
+# ---------------- VAULT STATS & QUOTA ----------------
+# reconcile leaves recently touched stats alone: an upload bumps its stats
+# just before its File document is saved
+RECONCILE_SETTLE = datetime.timedelta(minutes=5)
+
+def stats_type_key(file_type):
+    # by_type keys become field paths in $inc, so no '.' or '$'
+    return (file_type or 'Unknown').replace('.', '_').replace('$', '_')
+
+def _stats_inc(count, size, file_type, trash=False):
+    key = stats_type_key(file_type)
+    inc = {
+        'file_count': count,
+        'total_bytes': size,
+        f'by_type.{key}.count': count,
+        f'by_type.{key}.bytes': size,
+    }
+    if trash:
+        inc.update({'trash_count': count, 'trash_bytes': size})
+    return inc
+
+def reserve_vault_space(user_id, size, file_type):
+    """
+    Count a new file in the user's stats. Returns False, changing nothing, if
+    its live (non-trash) bytes would pass VAULT_QUOTA_BYTES. One conditional
+    update; the quota check and the increment are a single atomic operation.
+    """
+    quota = current_app.config['VAULT_QUOTA_BYTES']
+    query = {'user_id': user_id}
+    if quota is not None:
+        query['$expr'] = {'$lte': [
+            {'$subtract': ['$total_bytes', {'$ifNull': ['$trash_bytes', 0]}]},
+            quota - size,
+        ]}
+    update = {'$inc': _stats_inc(1, size, file_type), '$set': {'updated_at': datetime.datetime.utcnow()}}
+    coll = VaultStats._get_collection()
+    for _ in range(2):
+        if coll.update_one(query, update).matched_count:
+            return True
+        if coll.count_documents({'user_id': user_id}, limit=1):
+            return False
+        # no stats yet (first upload, or files from before stats existed)
+        reconcile_vault_stats(user_id)
+    return False
+
+def release_vault_space(user_id, size, file_type):
+    VaultStats._get_collection().update_one(
+        {'user_id': user_id},
+        {'$inc': _stats_inc(-1, -(size or 0), file_type), '$set': {'updated_at': datetime.datetime.utcnow()}},
+    )
+
+def move_to_trash_stats(user_id, size, direction):
+    """direction=1 when a file goes to the trash, -1 when it is restored."""
+    size = size or 0
+    VaultStats._get_collection().update_one(
+        {'user_id': user_id},
+        {'$inc': {'trash_count': direction, 'trash_bytes': direction * size},
+         '$set': {'updated_at': datetime.datetime.utcnow()}},
+    )
+
+def vault_full(user_id):
+    """Cheap pre-check so a full vault rejects uploads before they are streamed to storage."""
+    quota = current_app.config['VAULT_QUOTA_BYTES']
+    if quota is None:
+        return False
+    doc = VaultStats._get_collection().find_one({'user_id': user_id}, {'total_bytes': 1, 'trash_bytes': 1})
+    return doc is not None and doc.get('total_bytes', 0) - doc.get('trash_bytes', 0) >= quota
+
+def reconcile_vault_stats(user_id=None):
+    """
+    Recompute stats from the files collection (one aggregation, for every user or
+    just user_id) and overwrite the ones that drifted. Stats updated within
+    RECONCILE_SETTLE, or while this runs, are skipped until the next pass.
+    Returns the number of documents rewritten.
+    """
+    match = {} if user_id is None else {'user_id': user_id}
+    current = {d['user_id']: d for d in VaultStats._get_collection().find(match, {'_id': 0})}
+    pipeline = [{'$match': match}] if match else []
+    size = {'$ifNull': ['$size', 0]}
+    pipeline.append({'$group': {
+        '_id': {'user': '$user_id', 'type': '$file_type'},
+        'count': {'$sum': 1},
+        'bytes': {'$sum': size},
+        'trash_count': {'$sum': {'$cond': [{'$eq': ['$is_deleted', True]}, 1, 0]}},
+        'trash_bytes': {'$sum': {'$cond': [{'$eq': ['$is_deleted', True]}, size, 0]}},
+    }})
+    fields = ('file_count', 'total_bytes', 'trash_count', 'trash_bytes', 'by_type')
+    empty = lambda: {'file_count': 0, 'total_bytes': 0, 'trash_count': 0, 'trash_bytes': 0, 'by_type': {}}
+    totals = {uid: empty() for uid in current}
+    if user_id is not None:
+        totals.setdefault(user_id, empty())
+    for row in File._get_collection().aggregate(pipeline, allowDiskUse=True):
+        t = totals.setdefault(row['_id']['user'], empty())
+        t['file_count'] += row['count']
+        t['total_bytes'] += row['bytes']
+        t['trash_count'] += row['trash_count']
+        t['trash_bytes'] += row['trash_bytes']
+        entry = t['by_type'].setdefault(stats_type_key(row['_id'].get('type')), {'count': 0, 'bytes': 0})
+        entry['count'] += row['count']
+        entry['bytes'] += row['bytes']
+
+    now = datetime.datetime.utcnow()
+    coll = VaultStats._get_collection()
+    fixed = 0
+    for uid, t in totals.items():
+        old = current.get(uid)
+        if old is not None:
+            if old.get('updated_at') and old['updated_at'] > now - RECONCILE_SETTLE:
+                continue
+            if all(old.get(k, 0) == t[k] for k in fields):
+                continue
+        # matches only if untouched since we read it; otherwise the upsert hits
+        # the unique user_id index and the user is left for the next pass
+        try:
+            result = coll.replace_one(
+                {'user_id': uid, 'updated_at': old.get('updated_at') if old else None},
+                dict(t, user_id=uid, updated_at=now),
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            continue
+        fixed += result.modified_count + (1 if result.upserted_id is not None else 0)
+    return fixed
+
+@api.route('/api/vault/stats', methods=['GET'])
+@token_required
+def get_vault_stats(current_user):
+    coll = VaultStats._get_collection()
+    doc = coll.find_one({'user_id': current_user.id})
+    if doc is None:
+        reconcile_vault_stats(current_user.id)
+        doc = coll.find_one({'user_id': current_user.id}) or {}
+    return jsonify({
+        'file_count': doc.get('file_count', 0),
+        'total_bytes': doc.get('total_bytes', 0),
+        'trash_count': doc.get('trash_count', 0),
+        'trash_bytes': doc.get('trash_bytes', 0),
+        'by_type': doc.get('by_type', {}),
+        'quota_bytes': current_app.config['VAULT_QUOTA_BYTES'],
+    }), 200
+
 # ---------------- FILE/VAULT ROUTES ----------------
-@app.route('/api/vault/files', methods=['GET'])
+@api.route('/api/vault/files', methods=['GET'])
 @token_required
 def get_user_files(current_user):
     try:
@@ -161,56 +667,55 @@ def get_user_files(current_user):
         query_set = File.objects(user_id=current_user.id, is_deleted=False)
         if search_query:
             query_set = query_set.filter(filename__icontains=search_query)
-        files = query_set.order_by('-upload_date')
-        file_list = []
-        for file in files:
-            file_list.append({
-                'id': file.file_id,
-                'name': file.filename,
-                'type': file.file_type,
-                'mime_type': file.mime_type,
-                'size': file.size,
-                'date': file.upload_date.isoformat(),
-            })
+        # raw documents: no File hydration, datetimes are serialized by the JSON provider
+        docs = query_set.order_by('-upload_date').only(
+            'file_id', 'filename', 'file_type', 'mime_type', 'size', 'upload_date').as_pymongo()
+        file_list = [{
+            'id': d['file_id'],
+            'name': d['filename'],
+            'type': d.get('file_type'),
+            'mime_type': d.get('mime_type'),
+            'size': d.get('size'),
+            'date': d['upload_date'],
+        } for d in docs]
         return jsonify(file_list), 200
     except Exception as e:
         print(f"❌ get_user_files error: {e}")
         return jsonify({'error': 'Could not fetch files'}), 500
 
-@app.route('/api/vault/file/<file_id>/content', methods=['GET'])
+@api.route('/api/vault/file/<file_id>/content', methods=['GET'])
 @token_required
 def get_file_content(current_user, file_id):
     try:
         file_metadata = File.objects(file_id=file_id, user_id=current_user.id, is_deleted=False).first()
         if not file_metadata:
             return jsonify({"error": "File not found or access denied"}), 404
-        target_file_path = file_metadata.storage_path
-        if not os.path.exists(target_file_path):
+        store = vault_storage()
+        key, codec = file_metadata.storage_path, file_metadata.storage_codec
+        try:
+            content = store.direct_path(key, codec) or store.open(key, codec)
+        except FileNotFoundError:
             return jsonify({"error": "File content not on server"}), 404
-        return send_file(
-            target_file_path,
-            mimetype=file_metadata.mime_type,
-            as_attachment=False
-        )
+        return send_file(content, mimetype=file_metadata.mime_type, as_attachment=False)
     except Exception as e:
         print("❌ get_file_content error:", e)
         return jsonify({"error": str(e)}), 500
 
 # ---------------- CHAT ENDPOINTS ----------------
-@app.route('/api/chat/<file_id>', methods=['GET'])
+@api.route('/api/chat/<file_id>', methods=['GET'])
 @token_required
 def get_chat(current_user, file_id):
     """Return saved chat for this file (one chat per file)."""
     try:
-        chat_doc = FileChat.objects(user_id=current_user, file_id=file_id).first()
+        chat_doc = FileChat.objects(user_id=current_user, file_id=file_id).only('messages').as_pymongo().first()
         if not chat_doc:
             return jsonify({"messages": []}), 200
-        return jsonify({"messages": chat_doc.messages or []}), 200
+        return jsonify({"messages": chat_doc.get('messages') or []}), 200
     except Exception as e:
         print("❌ get_chat error:", e)
         return jsonify({"error": "Could not fetch chat"}), 500
 
-@app.route('/api/chat/<file_id>/save', methods=['POST'])
+@api.route('/api/chat/<file_id>/save', methods=['POST'])
 @token_required
 def save_chat(current_user, file_id):
     """Save (upsert) the chat messages for the file."""
@@ -234,13 +739,14 @@ def save_chat(current_user, file_id):
         print("❌ save_chat error:", e)
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/chat/<file_id>/ask', methods=['POST'])
+@api.route('/api/chat/<file_id>/ask', methods=['POST'])
 @token_required
 def ask_chat(current_user, file_id):
     """
     Ask a question about the file. We will:
     - load saved chat for context (if any)
-    - load file text (first N chars) as additional context
+    - add file text as context: the pages/slides the question refers to, else
+      the first few (see chat_file_context)
     - call Gemini to answer
     - return answer (but do NOT auto-save)
     """
@@ -254,28 +760,16 @@ def ask_chat(current_user, file_id):
         chat_doc = FileChat.objects(user_id=current_user, file_id=file_id).first()
         saved_messages = chat_doc.messages if chat_doc else []
 
-        # 2) load file content (first chunk) to provide context
+        # 2) load file content to provide context: the pages/slides the question
+        # mentions ("page 12", "slides 3-5", "p. 7"), else the first few
         file_meta = File.objects(file_id=file_id, user_id=current_user.id, is_deleted=False).first()
         file_text = ""
-        if file_meta and os.path.exists(file_meta.storage_path):
-            path = file_meta.storage_path
+        content_label = "first chunk"
+        if file_meta:
             try:
-                if path.endswith(".pdf"):
-                    with fitz.open(path) as doc:
-                        # read first few pages (avoid huge prompts)
-                        pages_to_read = min(5, doc.page_count)
-                        file_text = "\n".join([doc.load_page(i).get_text() for i in range(pages_to_read)])
-                elif path.endswith((".pptx", ".ppt")):
-                    prs = Presentation(path)
-                    texts = []
-                    for slide in prs.slides[:10]:
-                        for shape in slide.shapes:
-                            if hasattr(shape, "text"):
-                                texts.append(shape.text)
-                    file_text = "\n".join(texts)
-                elif path.endswith(".txt"):
-                    with open(path, "r", encoding="utf-8") as f:
-                        file_text = f.read(4000)
+                content_label, file_text = chat_file_context(file_meta, question)
+            except FileNotFoundError:
+                print(f"⚠️ file content missing: {file_meta.file_id}")
             except Exception as e:
                 print("⚠️ file_text read error:", e)
                 file_text = ""
@@ -290,15 +784,14 @@ def ask_chat(current_user, file_id):
 
         prompt = (
             "You are an assistant that answers questions about the uploaded file.\n\n"
-            f"File content (first chunk):\n{file_text[:4000]}\n\n"
+            f"File content ({content_label}):\n{file_text}\n\n"
             f"Conversation so far:\n{conversation_context}\n"
             f"User: {question}\n\nAnswer concisely and helpfully."
         )
 
         # 4) Call Gemini model
         try:
-            model = genai.GenerativeModel("gemini-2.5")
-            resp = model.generate_content(prompt)
+            resp = generate_content("gemini-2.5", prompt)
             answer = getattr(resp, 'text', None)
             if not answer and hasattr(resp, 'candidates'):
                 answer = resp.candidates[0].content.parts[0].text
@@ -316,10 +809,88 @@ def ask_chat(current_user, file_id):
         print("❌ ask_chat error:", e)
         return jsonify({"error": str(e)}), 500
 
+# budget for file text in chat prompts: the default first chunk, and explicitly referenced pages
+CHAT_CONTEXT_CHARS = 4000
+CHAT_REFERENCED_CHARS = 12000
+CHAT_MAX_REFERENCED_PAGES = 10
+
+def chat_file_context(file_meta, question):
+    """Return (label, text) for the ask_chat prompt; empty text if the type is unsupported."""
+    is_slides = file_meta.storage_path.lower().endswith(('.pptx', '.ppt'))
+    unit = "Slide" if is_slides else "Page"
+    first_count = 10 if is_slides else 5
+    refs = page_store.page_references(question, CHAT_MAX_REFERENCED_PAGES)
+    pages = current_app.extensions['page_store'].open(file_meta.file_id)
+    if pages is None and not refs:
+        # page text not built yet (upload build still running, or removed):
+        # parse just the first pages rather than the whole document
+        schedule_page_build(file_meta)
+        with vault_storage().local_path(file_meta.storage_path, file_meta.storage_codec) as path:
+            first = extract_pages(path, max_pages=first_count, max_slides=first_count,
+                                  max_chars=CHAT_CONTEXT_CHARS) or []
+        return "first chunk", "\n".join(first)[:CHAT_CONTEXT_CHARS]
+    if pages is None:
+        pages = file_pages(file_meta)
+        if pages is None:
+            return "first chunk", ""
+    with pages:
+        return _chat_pages_context(pages, refs, unit, first_count)
+
+def _chat_pages_context(pages, refs, unit, first_count):
+    if not refs:
+        first = pages.pages(1, first_count)
+        return "first chunk", "\n".join(first)[:CHAT_CONTEXT_CHARS]
+
+    per_page = CHAT_REFERENCED_CHARS // len(refs)
+    parts = []
+    for n in refs:
+        if n > pages.page_count:
+            parts.append(f"[{unit} {n}: not in this file, which has {pages.page_count}]")
+        else:
+            parts.append(f"[{unit} {n}]\n{pages.page(n)[:per_page]}")
+    label = f"{unit.lower()}s " + ", ".join(str(n) for n in refs)
+    return label, "\n\n".join(parts)
+
 # ---------------- PLANNER ROUTES (UNCHANGED: generate-plan, tasks etc.) ----------------
-@app.route('/api/planner/generate-plan', methods=['POST'])
+FALLBACK_DAYS = [
+    {'day': 1, 'focus': "Core concepts", 'tasks': [{'title': "Read core concepts", 'details': ''}]},
+    {'day': 2, 'focus': "Practice", 'tasks': [{'title': "Practice problems", 'details': ''}]},
+    {'day': 3, 'focus': "Revision", 'tasks': [{'title': "Revise and summarize", 'details': ''}]},
+]
+
+def create_plan_records(user_id, days, start_date):
+    """Bulk-insert one event per plan day and one task per plan item; returns their ids."""
+    now = datetime.datetime.utcnow()
+    task_docs, event_docs = [], []
+    for day in days:
+        day_date = start_date + datetime.timedelta(days=day['day'] - 1)
+        event_docs.append(new_planner_doc('event', user_id, {
+            'title': f"Day {day['day']}: {day['focus']}",
+            'description': "AI study plan",
+            'deadline': datetime.datetime.combine(day_date, datetime.time(23, 59)),
+        }, now))
+        for task in day['tasks']:
+            task_docs.append(new_planner_doc('task', user_id, {
+                'title': f"Day {day['day']}: {task['title']}",
+                'details': task['details'],
+            }, now))
+    if task_docs:
+        PlannerTask._get_collection().insert_many(task_docs, ordered=False)
+    if event_docs:
+        PlannerEvent._get_collection().insert_many(event_docs, ordered=False)
+        invalidate_alerts(user_id)
+    return [str(d['_id']) for d in task_docs], [str(d['_id']) for d in event_docs]
+
+@api.route('/api/planner/generate-plan', methods=['POST'])
 @token_required
 def generate_plan(current_user):
+    """
+    mode=markdown (default): free-form markdown plan.
+    mode=structured: JSON days/tasks, streamed and parsed line by line, then
+    bulk-inserted as PlannerTask / PlannerEvent records (optional start_date).
+    Plans are cached by normalized inputs for PLAN_CACHE_TTL_HOURS, so repeated
+    requests skip the model call.
+    """
     try:
         try:
             body = request.get_json(force=True)
@@ -331,9 +902,21 @@ def generate_plan(current_user):
         goals = (body.get('goals') or '').strip()
         subjects = (body.get('subjects') or '').strip()
         timeframe = (body.get('timeframe') or '').strip()
+        mode = body.get('mode') or 'markdown'
 
         if not (goals or subjects or timeframe):
             return jsonify({"error": "Provide at least one of goals/subjects/timeframe"}), 400
+        if mode not in ('markdown', 'structured'):
+            return jsonify({"error": "mode must be markdown or structured"}), 400
+
+        cache_key = study_plans.plan_cache_key(mode, goals, subjects, timeframe)
+        fresh_after = datetime.datetime.utcnow() - datetime.timedelta(hours=current_app.config['PLAN_CACHE_TTL_HOURS'])
+        cached = (AIPlan.objects(cache_key=cache_key, created_at__gte=fresh_after)
+                  .order_by('-created_at').only('plan_text', 'days').first())
+        metrics.record_cache('ai_plan', cached is not None)
+
+        if mode == 'structured':
+            return generate_structured_plan(current_user, body, goals, subjects, timeframe, cache_key, cached)
 
         prompt = (
             f"You are an expert study planner. Create a clear, actionable study plan.\n\n"
@@ -341,18 +924,19 @@ def generate_plan(current_user):
             "Return the plan in markdown format with day-wise steps."
         )
 
-        plan_text = None
-        try:
-            model = genai.GenerativeModel('gemini-2.5')
-            resp = model.generate_content(prompt)
-            plan_text = getattr(resp, 'text', None)
-            if not plan_text and hasattr(resp, 'candidates'):
-                plan_text = resp.candidates[0].content.parts[0].text
-        except Exception as inner_e:
-            print("⚠️ Gemini error:", inner_e)
-            plan_text = None
+        plan_text = cached.plan_text if cached else None
+        if not plan_text:
+            try:
+                resp = generate_content('gemini-2.5', prompt)
+                plan_text = getattr(resp, 'text', None)
+                if not plan_text and hasattr(resp, 'candidates'):
+                    plan_text = resp.candidates[0].content.parts[0].text
+            except Exception as inner_e:
+                print("⚠️ Gemini error:", inner_e)
+                plan_text = None
 
         if not plan_text:
+            cache_key = None
             plan_text = (
                 f"### Study Plan (auto-created)\n\n**Focus:** {subjects or goals}\n\n"
                 "- Day 1: Read core concepts\n"
@@ -361,15 +945,51 @@ def generate_plan(current_user):
                 "_This is an auto-generated fallback plan._"
             )
 
-        AIPlan(user_id=current_user, prompt=prompt, plan_text=plan_text).save()
-        return jsonify({"plan": plan_text}), 200
+        AIPlan(user_id=current_user, prompt=prompt, plan_text=plan_text, cache_key=cache_key).save()
+        return jsonify({"plan": plan_text, "cached": cached is not None}), 200
 
     except Exception as e:
         print("❌ generate_plan error:", e)
         return jsonify({"error": str(e)}), 500
 
+def generate_structured_plan(current_user, body, goals, subjects, timeframe, cache_key, cached):
+    start = parse_iso(body['start_date']) if body.get('start_date') else None
+    if body.get('start_date') and not start:
+        return jsonify({"error": "Invalid start_date"}), 400
+    start_date = (start or datetime.datetime.utcnow()).date()
+
+    prompt = study_plans.structured_prompt(goals, subjects, timeframe)
+    days = list(cached.days) if cached and cached.days else []
+    if not days:
+        parser = study_plans.DayStreamParser()
+        try:
+            for chunk in stream_content('gemini-2.5', prompt):
+                days.extend(parser.feed(chunk))
+        except Exception as inner_e:
+            # keep whatever days streamed in before the failure
+            print("⚠️ Gemini error:", inner_e)
+            cache_key = None
+        days.extend(parser.finish())
+    if not days:
+        cache_key = None
+        days = [dict(d, focus=f"{d['focus']} ({subjects or goals})"[:study_plans.MAX_TEXT]) for d in FALLBACK_DAYS]
+    days.sort(key=lambda d: d['day'])
+
+    plan_text = study_plans.render_markdown(days)
+    task_ids, event_ids = create_plan_records(current_user.id, days, start_date)
+    plan = AIPlan(user_id=current_user, prompt=prompt, plan_text=plan_text, mode='structured',
+                  days=days, cache_key=cache_key).save()
+    return jsonify({
+        "plan": plan_text,
+        "planId": str(plan.id),
+        "days": days,
+        "taskIds": task_ids,
+        "eventIds": event_ids,
+        "cached": cached is not None,
+    }), 200
+
 # ---------------- TASKS / UPDATES (UNCHANGED) ----------------
-@app.route('/api/planner/tasks', methods=['POST'])
+@api.route('/api/planner/tasks', methods=['POST'])
 @token_required
 def create_task(current_user):
     body = request.get_json() or {}
@@ -381,14 +1001,16 @@ def create_task(current_user):
     task.save()
     return jsonify({"taskId": str(task.id), "title": task.title}), 201
 
-@app.route('/api/planner/tasks', methods=['GET'])
+@api.route('/api/planner/tasks', methods=['GET'])
 @token_required
 def get_tasks(current_user):
-    tasks = PlannerTask.objects(user_id=current_user).order_by('-created_at')
-    data = [{"id": str(t.id), "title": t.title, "details": t.details, "done": t.done} for t in tasks]
+    tasks = PlannerTask.objects(user_id=current_user).order_by('-created_at').only(
+        'id', 'title', 'details', 'done').as_pymongo()
+    data = [{"id": t['_id'], "title": t['title'], "details": t.get('details'), "done": t.get('done', False)}
+            for t in tasks]
     return jsonify({"tasks": data})
 
-@app.route('/api/planner/tasks/<task_id>', methods=['PATCH'])
+@api.route('/api/planner/tasks/<task_id>', methods=['PATCH'])
 @token_required
 def update_task(current_user, task_id):
     body = request.get_json() or {}
@@ -400,11 +1022,20 @@ def update_task(current_user, task_id):
             setattr(task, key, body[key])
     if 'done' in body:
         task.done = bool(body['done'])
-    task.updated_at = datetime.datetime.utcnow()
     task.save()
     return jsonify({"ok": True})
 
-@app.route('/api/planner/events', methods=['POST'])
+@api.route('/api/planner/tasks/<task_id>', methods=['DELETE'])
+@token_required
+def delete_task(current_user, task_id):
+    task = PlannerTask.objects(id=task_id, user_id=current_user).first()
+    if not task:
+        return jsonify({"error": "Not found"}), 404
+    task.delete()
+    PlannerTombstone(user_id=current_user, kind='task', object_id=task.id).save()
+    return jsonify({"ok": True})
+
+@api.route('/api/planner/events', methods=['POST'])
 @token_required
 def create_event(current_user):
     body = request.get_json() or {}
@@ -418,16 +1049,263 @@ def create_event(current_user):
         return jsonify({"error": "Invalid date format"}), 400
     ev = PlannerEvent(user_id=current_user, title=title, description=description, deadline=dt)
     ev.save()
+    invalidate_alerts(current_user.id)
     return jsonify({"eventId": str(ev.id)}), 201
 
-@app.route('/api/planner/events', methods=['GET'])
+@api.route('/api/planner/events', methods=['GET'])
 @token_required
 def get_events(current_user):
-    q = PlannerEvent.objects(user_id=current_user)
-    events = [{"id": str(e.id), "title": e.title, "description": e.description, "deadline": e.deadline.isoformat()} for e in q]
+    q = PlannerEvent.objects(user_id=current_user).only('id', 'title', 'description', 'deadline').as_pymongo()
+    events = [{"id": e['_id'], "title": e['title'], "description": e.get('description'), "deadline": e['deadline']}
+              for e in q]
     return jsonify({"events": events})
 
-@app.route('/api/planner/upcoming-deadlines', methods=['GET'])
+@api.route('/api/planner/events/<event_id>', methods=['DELETE'])
+@token_required
+def delete_event(current_user, event_id):
+    ev = PlannerEvent.objects(id=event_id, user_id=current_user).first()
+    if not ev:
+        return jsonify({"error": "Not found"}), 404
+    ev.delete()
+    PlannerTombstone(user_id=current_user, kind='event', object_id=ev.id).save()
+    invalidate_alerts(current_user.id)
+    return jsonify({"ok": True})
+
+# ---------------- BULK OPERATIONS ----------------
+# Writable fields per kind: name -> validator returning (value, error)
+def _bulk_text(value, required=False):
+    if value is None and not required:
+        return '', None
+    if not isinstance(value, str) or (required and not value.strip()):
+        return None, "must be a non-empty string" if required else "must be a string"
+    return value.strip(), None
+
+def _bulk_bool(value):
+    if not isinstance(value, bool):
+        return None, "must be a boolean"
+    return value, None
+
+def _bulk_deadline(value):
+    dt = parse_iso(value) if isinstance(value, str) else None
+    if not dt:
+        return None, "must be an ISO datetime"
+    return dt, None
+
+BULK_FIELDS = {
+    'task': {
+        'title': lambda v: _bulk_text(v, required=True),
+        'details': _bulk_text,
+        'done': _bulk_bool,
+    },
+    'event': {
+        'title': lambda v: _bulk_text(v, required=True),
+        'description': _bulk_text,
+        'deadline': _bulk_deadline,
+    },
+}
+BULK_REQUIRED = {'task': ('title',), 'event': ('title', 'deadline')}
+
+def new_planner_doc(kind, user_id, values, now):
+    """Raw planner_tasks / planner_events document, as the models would store it."""
+    doc = {'_id': ObjectId(), 'user_id': user_id, 'created_at': now, 'updated_at': now}
+    if kind == 'task':
+        doc.update({'details': '', 'done': False})
+    else:
+        doc.update({'description': ''})
+    doc.update(values)
+    return doc
+
+def validate_bulk_op(op):
+    """Return (normalized op, error message)."""
+    if not isinstance(op, dict):
+        return None, "operation must be an object"
+    action, kind = op.get('op'), op.get('kind')
+    if action not in ('create', 'update', 'delete'):
+        return None, "op must be create, update or delete"
+    if kind not in BULK_FIELDS:
+        return None, "kind must be task or event"
+    normalized = {'op': action, 'kind': kind}
+    if action != 'create':
+        if not ObjectId.is_valid(op.get('id')):
+            return None, "id must be a valid object id"
+        normalized['id'] = ObjectId(op['id'])
+    if action == 'delete':
+        return normalized, None
+
+    data = op.get('data')
+    if not isinstance(data, dict) or not data:
+        return None, "data must be a non-empty object"
+    fields = BULK_FIELDS[kind]
+    unknown = set(data) - set(fields)
+    if unknown:
+        return None, f"unknown fields: {', '.join(sorted(unknown))}"
+    if action == 'create':
+        missing = [f for f in BULK_REQUIRED[kind] if f not in data]
+        if missing:
+            return None, f"missing fields: {', '.join(missing)}"
+    values = {}
+    for name, value in data.items():
+        values[name], error = fields[name](value)
+        if error:
+            return None, f"{name} {error}"
+    normalized['values'] = values
+    return normalized, None
+
+@api.route('/api/planner/bulk', methods=['POST'])
+@token_required
+def bulk_planner(current_user):
+    """
+    Apply a batch of task / event create, update and delete operations:
+    {"operations": [{"op": "create", "kind": "task", "data": {...}},
+                    {"op": "update", "kind": "event", "id": "...", "data": {...}},
+                    {"op": "delete", "kind": "task", "id": "..."}]}
+    The whole batch is validated first (400 with per-item errors if anything
+    is invalid, including an id used twice), then each collection gets one unordered bulk_write scoped to
+    the current user. Returns one result per operation, in order.
+    """
+    body = request.get_json(silent=True) or {}
+    operations = body.get('operations')
+    if not isinstance(operations, list) or not operations:
+        return jsonify({"error": "operations must be a non-empty list"}), 400
+    max_ops = current_app.config['PLANNER_BULK_MAX_OPS']
+    if len(operations) > max_ops:
+        return jsonify({"error": f"At most {max_ops} operations per batch"}), 400
+
+    normalized, errors = [], []
+    # unordered bulk_write gives no ordering between two ops on one document
+    first_use = {}
+    for index, op in enumerate(operations):
+        item, error = validate_bulk_op(op)
+        if item is not None and 'id' in item:
+            key = (item['kind'], item['id'])
+            if key in first_use:
+                error = f"id already used by operation {first_use[key]} in this batch"
+            else:
+                first_use[key] = index
+        normalized.append(item)
+        if error:
+            errors.append({"index": index, "ok": False, "error": error})
+    if errors:
+        return jsonify({"error": "Invalid batch", "results": errors}), 400
+
+    models = {'task': PlannerTask, 'event': PlannerEvent}
+    user_id = current_user.id
+    now = datetime.datetime.utcnow()
+    results = [{"index": i, "ok": True} for i in range(len(normalized))]
+
+    # one existence query per collection so missing / foreign ids get a per-item result
+    for kind, model in models.items():
+        ids = [item['id'] for item in normalized if item['kind'] == kind and item['op'] != 'create']
+        if ids:
+            found = {doc['_id'] for doc in model._get_collection().find(
+                {'_id': {'$in': ids}, 'user_id': user_id}, {'_id': 1})}
+            for index, item in enumerate(normalized):
+                if item['kind'] == kind and item['op'] != 'create' and item['id'] not in found:
+                    results[index] = {"index": index, "ok": False, "error": "Not found"}
+
+    requests_by_kind = {'task': [], 'event': [], 'tombstone': []}
+    # position in each bulk_write -> index in the request, to map writeErrors back
+    positions = {'task': [], 'event': [], 'tombstone': []}
+    for index, item in enumerate(normalized):
+        if not results[index]['ok']:
+            continue
+        kind = item['kind']
+        if item['op'] == 'create':
+            doc = new_planner_doc(kind, user_id, item['values'], now)
+            requests_by_kind[kind].append(InsertOne(doc))
+            results[index]['id'] = str(doc['_id'])
+        elif item['op'] == 'update':
+            requests_by_kind[kind].append(UpdateOne(
+                {'_id': item['id'], 'user_id': user_id},
+                {'$set': dict(item['values'], updated_at=now)}))
+        else:
+            requests_by_kind[kind].append(DeleteOne({'_id': item['id'], 'user_id': user_id}))
+            requests_by_kind['tombstone'].append(InsertOne(
+                {'user_id': user_id, 'kind': kind, 'object_id': item['id'], 'deleted_at': now}))
+            positions['tombstone'].append(index)
+        positions[kind].append(index)
+
+    collections = {'task': PlannerTask, 'event': PlannerEvent, 'tombstone': PlannerTombstone}
+    for kind, writes in requests_by_kind.items():
+        if not writes:
+            continue
+        try:
+            collections[kind]._get_collection().bulk_write(writes, ordered=False)
+        except BulkWriteError as e:
+            for write_error in e.details.get('writeErrors', []):
+                index = positions[kind][write_error['index']]
+                results[index] = {"index": index, "ok": False, "error": write_error.get('errmsg', 'Write failed')}
+
+    if requests_by_kind['event']:
+        invalidate_alerts(user_id)
+    return jsonify({"ok": all(r['ok'] for r in results), "results": results})
+
+# ---------------- DELTA SYNC ----------------
+# Writes that commit slightly after a sync query started can carry an
+# updated_at just before the returned token; re-sending that overlap is cheap
+# and clients apply changes idempotently by id.
+SYNC_OVERLAP = datetime.timedelta(seconds=5)
+
+def encode_sync_token(dt):
+    return str(int(dt.replace(tzinfo=datetime.timezone.utc).timestamp() * 1000))
+
+def decode_sync_token(token):
+    try:
+        return datetime.datetime.utcfromtimestamp(int(token) / 1000.0)
+    except (TypeError, ValueError, OverflowError, OSError):
+        # OSError: out of the platform's time_t range (e.g. ?since=99999999999999999999)
+        return None
+
+@api.route('/api/planner/sync', methods=['GET'])
+@token_required
+def sync_planner(current_user):
+    """
+    Tasks / events changed since ?since=<token>, plus ids deleted since then.
+    Without a token (or with one older than the tombstone retention) the full
+    lists are returned with reset=true. Store the returned token for next time.
+    """
+    now = datetime.datetime.utcnow()
+    since = None
+    token = request.args.get('since')
+    if token:
+        since = decode_sync_token(token)
+        if since is None:
+            return jsonify({"error": "Invalid sync token"}), 400
+        if since < now - datetime.timedelta(days=TOMBSTONE_RETENTION_DAYS):
+            since = None
+    reset = since is None
+
+    task_query = {'user_id': current_user.id}
+    event_query = {'user_id': current_user.id}
+    if not reset:
+        task_query['updated_at'] = {'$gte': since - SYNC_OVERLAP}
+        event_query['updated_at'] = {'$gte': since - SYNC_OVERLAP}
+
+    tasks = [
+        {"id": str(t['_id']), "title": t['title'], "details": t.get('details'), "done": t.get('done', False)}
+        for t in PlannerTask._get_collection().find(task_query, {'title': 1, 'details': 1, 'done': 1})
+    ]
+    events = [
+        {"id": str(e['_id']), "title": e['title'], "description": e.get('description'),
+         "deadline": e['deadline'].isoformat()}
+        for e in PlannerEvent._get_collection().find(event_query, {'title': 1, 'description': 1, 'deadline': 1})
+    ]
+    deleted = {"tasks": [], "events": []}
+    if not reset:
+        for tomb in PlannerTombstone._get_collection().find(
+                {'user_id': current_user.id, 'deleted_at': {'$gte': since - SYNC_OVERLAP}},
+                {'kind': 1, 'object_id': 1}):
+            deleted[tomb['kind'] + 's'].append(str(tomb['object_id']))
+
+    return jsonify({
+        "tasks": tasks,
+        "events": events,
+        "deleted": deleted,
+        "reset": reset,
+        "token": encode_sync_token(now),
+    })
+
+@api.route('/api/planner/upcoming-deadlines', methods=['GET'])
 @token_required
 def get_upcoming_deadlines(current_user):
     now = datetime.datetime.utcnow()
@@ -435,93 +1313,279 @@ def get_upcoming_deadlines(current_user):
     out = [{"id": str(e.id), "title": e.title, "deadline": e.deadline.isoformat()} for e in evs]
     return jsonify({"deadlines": out})
 
-@app.route('/api/planner/alerts', methods=['GET'])
+@api.route('/api/planner/alerts', methods=['GET'])
 @token_required
 def get_alerts(current_user):
+    """
+    Expired (within ALERTS_LOOKBACK_DAYS), upcoming (next hour) and reminder
+    (next ALERTS_REMINDER_LOOKAHEAD_DAYS) alerts from a single range scan over
+    (user_id, deadline), newest deadline first. Paginate with ?limit= and the
+    returned next_cursor.
+    """
+    config = current_app.config
+    try:
+        limit = int(request.args.get('limit', config['ALERTS_PAGE_SIZE']))
+    except ValueError:
+        return jsonify({"error": "Invalid limit"}), 400
+    limit = max(1, min(limit, config['ALERTS_MAX_PAGE_SIZE']))
+    cursor = request.args.get('cursor')
+    after = None
+    if cursor:
+        after = decode_cursor(cursor)
+        if not after:
+            return jsonify({"error": "Invalid cursor"}), 400
+
+    user_key = str(current_user.id)
+    cached = alerts_cache.get(user_key, (cursor, limit))
+    if cached is not None:
+        return jsonify(cached)
+
     now = datetime.datetime.utcnow()
+    since = now - datetime.timedelta(days=config['ALERTS_LOOKBACK_DAYS'])
     in_one_hour = now + datetime.timedelta(hours=1)
+    reminders_until = max(in_one_hour, now + datetime.timedelta(days=config['ALERTS_REMINDER_LOOKAHEAD_DAYS']))
 
-    expired = PlannerEvent.objects(user_id=current_user, deadline__lte=now, description__ne="Reminder")
-    soon = PlannerEvent.objects(user_id=current_user, deadline__gt=now, deadline__lte=in_one_hour, description__ne="Reminder")
-
-    alerts = [
-        {
-            "id": str(e.id),
-            "type": "expired",
-            "message": f"Deadline expired: {e.title}",
-            "deadline": e.deadline.isoformat(),
-        }
-        for e in expired
-    ]
-    alerts += [
-        {
-            "id": str(e.id),
-            "type": "upcoming",
-            "message": f"Upcoming soon: {e.title}",
-            "deadline": e.deadline.isoformat(),
-        }
-        for e in soon
-    ]
+    # one bounded range on the index; beyond the hour only reminders qualify
+    query = {
+        'user_id': current_user.id,
+        'deadline': {'$gte': since, '$lte': reminders_until},
+        '$and': [{'$or': [{'deadline': {'$lte': in_one_hour}}, {'description': "Reminder"}]}],
+    }
+    if after:
+        after_deadline, after_id = after
+        query['$and'].append({'$or': [
+            {'deadline': {'$lt': after_deadline}},
+            {'deadline': after_deadline, '_id': {'$lt': after_id}},
+        ]})
+    rows = list(
+        PlannerEvent._get_collection()
+        .find(query, {'title': 1, 'description': 1, 'deadline': 1})
+        .sort([('deadline', -1), ('_id', -1)])
+        .limit(limit + 1)
+    )
 
-    reminders = PlannerEvent.objects(user_id=current_user, description="Reminder")
-    alerts += [
-        {
-            "id": str(r.id),
-            "type": "reminder",
-            "message": f"Reminder: {r.title}",
-            "deadline": r.deadline.isoformat() if r.deadline else None,
-        }
-        for r in reminders
+    alerts = []
+    for row in rows[:limit]:
+        if row.get('description') == "Reminder":
+            alert_type, message = "reminder", f"Reminder: {row['title']}"
+        elif row['deadline'] <= now:
+            alert_type, message = "expired", f"Deadline expired: {row['title']}"
+        else:
+            alert_type, message = "upcoming", f"Upcoming soon: {row['title']}"
+        alerts.append({
+            "id": str(row['_id']),
+            "type": alert_type,
+            "message": message,
+            "deadline": row['deadline'].isoformat(),
+        })
+
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = encode_cursor(last['deadline'], last['_id'])
+
+    result = {"alerts": alerts, "next_cursor": next_cursor}
+    alerts_cache.set(user_key, (cursor, limit), result)
+    return jsonify(result)
+
+# ---------------- BACKGROUND CHECKER ----------------
+# re-examine a few seconds before the last tick: writes in flight during it
+CHECKER_OVERLAP = datetime.timedelta(seconds=5)
+
+def check_planner_deadlines(now=None, since=None):
+    """
+    One tick of the planner checker: create alerts for expired events that have
+    none yet. Only events that expired after `since`, or were written after it
+    with a deadline already past, are looked at, so a tick costs what changed
+    since the previous one. since=None (the first tick of a process) covers the
+    whole ALERTS_LOOKBACK_DAYS window. At most three queries; returns the
+    watermark to pass as `since` next time.
+    """
+    now = now or datetime.datetime.utcnow()
+    watermark = now - CHECKER_OVERLAP
+    floor = now - datetime.timedelta(days=current_app.config['ALERTS_LOOKBACK_DAYS'])
+    query = {'deadline': {'$gte': floor, '$lte': now}}
+    if since is not None and since > floor:
+        query['$or'] = [{'deadline': {'$gt': since}}, {'updated_at': {'$gt': since}}]
+    expired_events = list(PlannerEvent._get_collection().find(query, {'user_id': 1, 'title': 1}))
+    if not expired_events:
+        return watermark
+    event_ids = [ev['_id'] for ev in expired_events]
+    alerted = set(Alert._get_collection().distinct('related_event', {'related_event': {'$in': event_ids}}))
+    new_alerts = [
+        Alert(user_id=ev['user_id'], message=f"Deadline expired: {ev['title']}", related_event=ev['_id'])
+        for ev in expired_events if ev['_id'] not in alerted
     ]
+    if new_alerts:
+        Alert.objects.insert(new_alerts, load_bulk=False)
+        for user_id in {ev['user_id'] for ev in expired_events if ev['_id'] not in alerted}:
+            invalidate_alerts(user_id)
+    return watermark
 
-    return jsonify({"alerts": alerts})
 
-# ---------------- BACKGROUND CHECKER ----------------
-def planner_background_checker(interval=30):
+def planner_background_checker(app, interval=30):
     def run():
         with app.app_context():
+            since = None
             while True:
                 try:
-                    now = datetime.datetime.utcnow()
-                    expired_events = PlannerEvent.objects(deadline__lte=now)
-                    for ev in expired_events:
-                        if not Alert.objects(related_event=ev).first():
-                            Alert(user_id=ev.user_id, message=f"Deadline expired: {ev.title}", related_event=ev).save()
+                    with query_accounting.track('planner_checker'):
+                        since = check_planner_deadlines(since=since)
                 except Exception as e:
                     print("Planner background checker error:", e)
                 time.sleep(interval)
-    threading.Thread(target=run, daemon=True).start()
+    checker_thread = threading.Thread(target=run, daemon=True, name='PlannerChecker')
+    checker_thread.start()
+    return checker_thread
 
-planner_background_checker(30)
 
-# ---------------- AUTH (unchanged) ----------------
-@app.route('/api/auth/register', methods=['POST'])
+def vault_stats_reconciler(app, interval=3600):
+    def run():
+        with app.app_context():
+            while True:
+                # stats are kept current inline; this pass only repairs drift
+                time.sleep(interval)
+                try:
+                    with query_accounting.track('vault_stats_reconcile'):
+                        fixed = reconcile_vault_stats()
+                    if fixed:
+                        print(f"⚠️ vault stats: repaired {fixed} drifted document(s)")
+                except Exception as e:
+                    print("Vault stats reconcile error:", e)
+    reconcile_thread = threading.Thread(target=run, daemon=True, name='VaultStatsReconciler')
+    reconcile_thread.start()
+    return reconcile_thread
+
+
+GC_RETRY_DELAY = datetime.timedelta(hours=1)
+
+def collect_trash(now=None, batch_size=100):
+    """
+    Purge one batch of trashed files whose purge_at has passed: blobs and page text first,
+    then chats and File documents in one call each, then stats. Files whose
+    blob could not be removed are retried after GC_RETRY_DELAY, so they never
+    block the files behind them. Returns the batch size (== batch_size means
+    more may be waiting).
+    """
+    now = now or datetime.datetime.utcnow()
+    files = File._get_collection()
+    batch = list(
+        files
+        .find({'purge_at': {'$lte': now}, 'is_deleted': True},
+              {'file_id': 1, 'user_id': 1, 'storage_path': 1, 'storage_codec': 1, 'size': 1, 'file_type': 1})
+        .sort('purge_at', 1)
+        .limit(batch_size)
+    )
+    if not batch:
+        return 0
+    store = vault_storage()
+    purged, failed = [], []
+    for doc in batch:
+        try:
+            store.delete(doc['storage_path'], doc.get('storage_codec'))
+            current_app.extensions['page_store'].delete(doc['file_id'])
+        except Exception as e:
+            print(f"⚠️ vault GC: could not delete blob for {doc['file_id']}: {e}")
+            failed.append(doc['_id'])
+            continue
+        purged.append(doc)
+    if failed:
+        files.update_many({'_id': {'$in': failed}, 'is_deleted': True},
+                          {'$set': {'purge_at': now + GC_RETRY_DELAY}})
+    if not purged:
+        return len(batch)
+
+    FileChat._get_collection().delete_many(
+        {'$or': [{'user_id': d['user_id'], 'file_id': d['file_id']} for d in purged]})
+    File._get_collection().delete_many(
+        {'_id': {'$in': [d['_id'] for d in purged]}, 'is_deleted': True})
+
+    # summed per user: one stats update per owner in the batch, not per file
+    incs = {}
+    for d in purged:
+        inc = incs.setdefault(d['user_id'], {})
+        for field, value in _stats_inc(-1, -(d.get('size') or 0), d.get('file_type'), trash=True).items():
+            inc[field] = inc.get(field, 0) + value
+    stats = VaultStats._get_collection()
+    for uid, inc in incs.items():
+        stats.update_one({'user_id': uid}, {'$inc': inc, '$set': {'updated_at': now}})
+    return len(batch)
+
+
+def vault_gc(app, interval=300, batch_size=100, pause=0.5):
+    def run():
+        with app.app_context():
+            while True:
+                try:
+                    with query_accounting.track('vault_gc'):
+                        # drain in batches, pausing in between so a big purge
+                        # doesn't monopolize disk/S3 and Mongo
+                        while collect_trash(batch_size=batch_size) >= batch_size:
+                            time.sleep(pause)
+                except Exception as e:
+                    print("Vault GC error:", e)
+                time.sleep(interval)
+    gc_thread = threading.Thread(target=run, daemon=True, name='VaultGC')
+    gc_thread.start()
+    return gc_thread
+
+
+def start_background_services(app):
+    """Start background services once per process (opt-in, see create_app)."""
+    running = {t.name for t in threading.enumerate()}
+    if 'PlannerChecker' not in running:
+        planner_background_checker(app, app.config['PLANNER_CHECK_INTERVAL'])
+    if 'VaultStatsReconciler' not in running:
+        vault_stats_reconciler(app, app.config['VAULT_STATS_RECONCILE_INTERVAL'])
+    if 'VaultGC' not in running:
+        vault_gc(app, app.config['VAULT_GC_INTERVAL'], app.config['VAULT_GC_BATCH_SIZE'], app.config['VAULT_GC_PAUSE'])
+
+# ---------------- AUTH ----------------
+def too_busy():
+    return jsonify({"error": "Too many requests, try again shortly"}), 429, {'Retry-After': '1'}
+
+@api.route('/api/auth/register', methods=['POST'])
 def register_user():
     body = request.get_json()
     if not body or not body.get('email') or not body.get('password'):
         return jsonify({"error": "Missing required fields"}), 400
     if User.objects(email=body.get('email')).first():
         return jsonify({"error": "User exists"}), 409
-    hashed = bcrypt.hashpw(body['password'].encode('utf-8'), bcrypt.gensalt())
-    user = User(firstName=body.get('firstName'), email=body['email'], password=hashed.decode('utf-8')).save()
+    try:
+        hashed = current_app.extensions['password_hasher'].hash(body['password'])
+    except passwords.HashPoolBusy:
+        return too_busy()
+    user = User(firstName=body.get('firstName'), email=body['email'], password=hashed).save()
     return jsonify({"message": f"User '{user.email}' registered successfully"}), 201
 
-@app.route('/api/auth/login', methods=['POST'])
+@api.route('/api/auth/login', methods=['POST'])
 def login_user():
-    body = request.get_json()
+    body = request.get_json() or {}
+    if not body.get('email') or not body.get('password'):
+        return jsonify({"error": "Missing required fields"}), 400
+    hasher = current_app.extensions['password_hasher']
     user = User.objects(email=body.get('email')).first()
-    if not user or not bcrypt.checkpw(body['password'].encode('utf-8'), user.password.encode('utf-8')):
-        return jsonify({"error": "Invalid credentials"}), 401
-    token = jwt.encode({'user_id': str(user.id), 'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=5)}, app.config['JWT_SECRET'], algorithm="HS256")
+    try:
+        if not user or not hasher.verify(body['password'], user.password):
+            return jsonify({"error": "Invalid credentials"}), 401
+    except passwords.HashPoolBusy:
+        return too_busy()
+    if hasher.needs_rehash(user.password):
+        # cost factor changed since this hash was made; upgrade it transparently
+        try:
+            User.objects(id=user.id).update_one(set__password=hasher.hash(body['password']))
+        except passwords.HashPoolBusy:
+            pass
+    token = jwt.encode({'user_id': str(user.id), 'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=5)}, current_app.config['JWT_SECRET'], algorithm="HS256")
     return jsonify({"token": token})
 
-@app.route('/api/auth/me', methods=['GET'])
+@api.route('/api/auth/me', methods=['GET'])
 @token_required
 def get_current_user(current_user):
     return jsonify(id=str(current_user.id), firstName=current_user.firstName, email=current_user.email)
 
 # ---------------- FILE UPLOAD & AI ROUTES (upload, summarize, mcqs) ----------------
-@app.route('/api/upload', methods=['POST'])
+@api.route('/api/upload', methods=['POST'])
 @token_required
 def upload_file(current_user):
     if 'file' not in request.files:
@@ -536,20 +1600,35 @@ def upload_file(current_user):
     file_id = str(uuid.uuid4())
     ext = os.path.splitext(original_filename)[1]
 
-    save_path = os.path.join(MY_VAULT_FOLDER, f"{file_id}{ext}")
-    file.save(save_path)
-    file_size = os.path.getsize(save_path)
+    if vault_full(current_user.id):
+        return jsonify({"error": "Storage quota exceeded"}), 413
+
+    store = vault_storage()
+    storage_key = storage.shard_key(file_id, ext)
+    storage_codec = store.codec_for(storage_key).suffix
+    file_size, _ = store.save(storage_key, file.stream)
+    if not reserve_vault_space(current_user.id, file_size, file_type):
+        store.delete(storage_key, storage_codec)
+        return jsonify({"error": "Storage quota exceeded"}), 413
 
     new_file = File(
         user_id=current_user,
         filename=original_filename,
         file_id=file_id,
-        storage_path=save_path,
+        storage_path=storage_key,
+        storage_codec=storage_codec,
         file_type=file_type,
         mime_type=file.mimetype,
         size=file_size
     )
-    new_file.save()
+    try:
+        new_file.save()
+    except Exception:
+        release_vault_space(current_user.id, file_size, file_type)
+        store.delete(storage_key, storage_codec)
+        raise
+    # chat / summarize / mcqs read the extracted text; parse it now, off the request
+    schedule_page_build(new_file)
 
     response_file = {
         'id': new_file.file_id,
@@ -562,37 +1641,23 @@ def upload_file(current_user):
 
     return jsonify({"fileId": file_id, "file": response_file}), 200
 
-@app.route('/api/summarize/<file_id>', methods=['GET'])
+@api.route('/api/summarize/<file_id>', methods=['GET'])
 @token_required
 def summarize_file(current_user, file_id):
     try:
-        file_metadata = File.objects(file_id=file_id, user_id=current_user.id).first()
+        file_metadata = File.objects(file_id=file_id, user_id=current_user.id, is_deleted=False).first()
         if not file_metadata:
             return jsonify({"error": "File not found in vault"}), 404
 
-        target_file = file_metadata.storage_path
-        if not os.path.exists(target_file):
+        try:
+            text_content = file_text(file_metadata)
+        except FileNotFoundError:
             return jsonify({"error": "File content not on server"}), 404
-
-        text_content = ""
-        if target_file.endswith(".pdf"):
-            with fitz.open(target_file) as doc:
-                text_content = "\n".join([page.get_text() for page in doc])
-        elif target_file.endswith((".pptx", ".ppt")):
-            prs = Presentation(target_file)
-            for slide in prs.slides:
-                for shape in slide.shapes:
-                    if hasattr(shape, "text"):
-                        text_content += shape.text + "\n"
-        elif target_file.endswith(".txt"):
-            with open(target_file, "r", encoding="utf-8") as f:
-                text_content = f.read()
-        else:
+        if text_content is None:
             return jsonify({"error": "Unsupported file type"}), 400
 
-        model = genai.GenerativeModel("gemini-2.0-flash")
         prompt = f"Summarize this text concisely:\n\n{text_content[:5000]}"
-        response = model.generate_content(prompt)
+        response = generate_content("gemini-2.0-flash", prompt)
         summary = response.text.strip() if hasattr(response, "text") else "No summary generated."
 
         return jsonify({"summary": summary}), 200
@@ -601,35 +1666,21 @@ def summarize_file(current_user, file_id):
         print("❌ summarize_file error:", e)
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/mcqs/<file_id>', methods=['GET'])
+@api.route('/api/mcqs/<file_id>', methods=['GET'])
 @token_required
 def generate_mcqs(current_user, file_id):
     try:
-        file_metadata = File.objects(file_id=file_id, user_id=current_user.id).first()
+        file_metadata = File.objects(file_id=file_id, user_id=current_user.id, is_deleted=False).first()
         if not file_metadata:
             return jsonify({"error": "File not found in vault"}), 404
 
-        target_file = file_metadata.storage_path
-        if not os.path.exists(target_file):
+        try:
+            text_content = file_text(file_metadata) or ""
+        except FileNotFoundError:
             return jsonify({"error": "File content not on server"}), 404
 
-        text_content = ""
-        if target_file.endswith(".pdf"):
-            with fitz.open(target_file) as doc:
-                text_content = "\n".join([page.get_text() for page in doc])
-        elif target_file.endswith((".pptx", ".ppt")):
-            prs = Presentation(target_file)
-            for slide in prs.slides:
-                for shape in slide.shapes:
-                    if hasattr(shape, "text"):
-                        text_content += shape.text + "\n"
-        elif target_file.endswith(".txt"):
-            with open(target_file, "r", encoding="utf-8") as f:
-                text_content = f.read()
-
-        model = genai.GenerativeModel("gemini-2.0-flash")
         prompt = f"Generate 5 MCQs from this content with options and correct answers in JSON format:\n{text_content[:5000]}"
-        response = model.generate_content(prompt)
+        response = generate_content("gemini-2.0-flash", prompt)
 
         mcqs_json = []
         try:
@@ -644,34 +1695,75 @@ def generate_mcqs(current_user, file_id):
         print("❌ generate_mcqs error:", e)
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/vault/file/<file_id>/delete', methods=['DELETE'])
+@api.route('/api/vault/file/<file_id>/delete', methods=['DELETE'])
 @token_required
 def delete_file_permanently(current_user, file_id):
+    """
+    Move the file to the trash. Blob, chat and derived data are removed later by
+    the vault GC (collect_trash) once VAULT_TRASH_RETENTION_DAYS have passed;
+    until then the file can be restored.
+    """
     try:
-        file = File.objects(file_id=file_id, user_id=current_user.id).first()
-        if not file:
+        now = datetime.datetime.utcnow()
+        retention = datetime.timedelta(days=current_app.config['VAULT_TRASH_RETENTION_DAYS'])
+        doc = File._get_collection().find_one_and_update(
+            {'file_id': file_id, 'user_id': current_user.id, 'is_deleted': {'$ne': True}},
+            {'$set': {'is_deleted': True, 'deleted_at': now, 'purge_at': now + retention}},
+            projection={'size': 1},
+        )
+        if doc is None:
             return jsonify({"error": "File not found"}), 404
-
-        # Remove file from storage
-        if os.path.exists(file.storage_path):
-            os.remove(file.storage_path)
-
-        # Remove from database
-        file.delete()
-
-        # Also delete chat for this file (optional but correct)
-        FileChat.objects(file_id=file_id, user_id=current_user.id).delete()
-
-        return jsonify({"success": True}), 200
+        move_to_trash_stats(current_user.id, doc.get('size'), 1)
+        return jsonify({"success": True, "purge_at": (now + retention).isoformat()}), 200
 
     except Exception as e:
-        print("❌ Permanent delete error:", e)
+        print("❌ Delete error:", e)
         return jsonify({"error": str(e)}), 500
 
+@api.route('/api/vault/file/<file_id>/restore', methods=['POST'])
+@token_required
+def restore_file(current_user, file_id):
+    # purge_at > now: once a file is due (or the trash was emptied) the GC owns it
+    doc = File._get_collection().find_one_and_update(
+        {'file_id': file_id, 'user_id': current_user.id, 'is_deleted': True,
+         'purge_at': {'$gt': datetime.datetime.utcnow()}},
+        {'$set': {'is_deleted': False}, '$unset': {'deleted_at': '', 'purge_at': ''}},
+        projection={'size': 1},
+    )
+    if doc is None:
+        return jsonify({"error": "File not found in trash"}), 404
+    move_to_trash_stats(current_user.id, doc.get('size'), -1)
+    return jsonify({"success": True}), 200
+
+@api.route('/api/vault/trash', methods=['GET'])
+@token_required
+def get_trash(current_user):
+    docs = File.objects(user_id=current_user.id, is_deleted=True).order_by('-deleted_at').only(
+        'file_id', 'filename', 'file_type', 'mime_type', 'size', 'deleted_at', 'purge_at').as_pymongo()
+    return jsonify([{
+        'id': d['file_id'],
+        'name': d['filename'],
+        'type': d.get('file_type'),
+        'mime_type': d.get('mime_type'),
+        'size': d.get('size'),
+        'deleted_at': d.get('deleted_at'),
+        'purge_at': d.get('purge_at'),
+    } for d in docs]), 200
+
+@api.route('/api/vault/trash', methods=['DELETE'])
+@token_required
+def empty_trash(current_user):
+    """Make everything in the trash due now; the next GC pass purges it."""
+    result = File._get_collection().update_many(
+        {'user_id': current_user.id, 'is_deleted': True},
+        {'$set': {'purge_at': datetime.datetime.utcnow()}},
+    )
+    return jsonify({"success": True, "files": result.modified_count}), 200
+
 # ---------------- RUN APP ----------------
 if __name__ == '__main__':
-    if not any(t.name == 'PlannerChecker' for t in threading.enumerate()):
-        checker_thread = threading.Thread(target=planner_background_checker, args=(30,), daemon=True, name='PlannerChecker')
-        checker_thread.start()
-
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    # With debug=True the reloader runs this block twice; only the child
+    # process (WERKZEUG_RUN_MAIN) should own the background services.
+    run_background = os.environ.get('WERKZEUG_RUN_MAIN') == 'true'
+    app = create_app(start_background=run_background)
+    app.run(host='0.0.0.0', port=5000, debug=True)
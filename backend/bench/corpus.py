@@ -0,0 +1,95 @@
+"""
+Synthetic vault and planner data for the benchmark suite.
+
+Everything is seeded so two runs with the same arguments produce the same corpus.
+"""
+import datetime
+import io
+import random
+
+WORDS = (
+    "algorithm entropy photosynthesis integral derivative matrix vector theorem "
+    "enzyme protein market equilibrium inflation momentum velocity circuit voltage "
+    "resistance syntax compiler recursion graph network layer gradient lemma proof"
+).split()
+
+# name -> (pages or slides, paragraphs per page)
+SIZES = {
+    'small': (2, 3),
+    'medium': (20, 6),
+    'large': (120, 8),
+}
+
+
+def _paragraph(rng, words=60):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def make_txt(size, seed=0):
+    rng = random.Random(seed)
+    pages, paragraphs = SIZES[size]
+    text = "\n\n".join(_paragraph(rng) for _ in range(pages * paragraphs))
+    return text.encode('utf-8')
+
+
+def make_pdf(size, seed=0):
+    import fitz  # PyMuPDF
+    rng = random.Random(seed)
+    pages, paragraphs = SIZES[size]
+    doc = fitz.open()
+    for page_no in range(pages):
+        page = doc.new_page()
+        body = "\n".join(_paragraph(rng, 12) for _ in range(paragraphs))
+        page.insert_text((72, 72), f"Page {page_no + 1}\n{body}", fontsize=9)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def make_pptx(size, seed=0):
+    from pptx import Presentation
+    rng = random.Random(seed)
+    slides, paragraphs = SIZES[size]
+    prs = Presentation()
+    layout = prs.slide_layouts[1]
+    for slide_no in range(slides):
+        slide = prs.slides.add_slide(layout)
+        slide.shapes.title.text = f"Slide {slide_no + 1}"
+        slide.placeholders[1].text = "\n".join(_paragraph(rng, 10) for _ in range(paragraphs))
+    out = io.BytesIO()
+    prs.save(out)
+    return out.getvalue()
+
+
+MAKERS = {
+    'txt': (make_txt, 'text/plain'),
+    'pdf': (make_pdf, 'application/pdf'),
+    'pptx': (make_pptx, 'application/vnd.openxmlformats-officedocument.presentationml.presentation'),
+}
+
+
+def build_corpus(kinds=('txt', 'pdf', 'pptx'), sizes=('small', 'medium', 'large'), seed=0):
+    """Return a list of (filename, bytes, mimetype) covering every kind x size."""
+    corpus = []
+    for i, kind in enumerate(kinds):
+        maker, mimetype = MAKERS[kind]
+        for j, size in enumerate(sizes):
+            corpus.append((f"{size}_{kind}.{kind}", maker(size, seed=seed + i * 10 + j), mimetype))
+    return corpus
+
+
+def planner_rows(rng, now, tasks=50, events=40):
+    """Synthetic tasks and events for one user: a mix of past, imminent and future deadlines."""
+    task_rows = [
+        {'title': f"Task {i}", 'details': _paragraph(rng, 8), 'done': rng.random() < 0.4}
+        for i in range(tasks)
+    ]
+    event_rows = []
+    for i in range(events):
+        offset = datetime.timedelta(minutes=rng.randint(-60 * 24 * 60, 60 * 24 * 30))
+        event_rows.append({
+            'title': f"Event {i}",
+            'description': "Reminder" if rng.random() < 0.2 else _paragraph(rng, 6),
+            'deadline': now + offset,
+        })
+    return task_rows, event_rows
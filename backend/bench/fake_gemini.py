@@ -0,0 +1,72 @@
+"""
+Deterministic local stand-in for google.generativeai models.
+
+Plug it in with create_app({'GEMINI_MODEL_FACTORY': FakeModelFactory(latency_ms=...)}).
+Responses depend only on the prompt, so runs are reproducible.
+"""
+import hashlib
+import json
+import random
+import time
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeModel:
+    def __init__(self, model_name, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0):
+        self.model_name = model_name
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+
+    def generate_content(self, prompt, stream=False):
+        seed = int.from_bytes(hashlib.sha256(prompt.encode('utf-8')).digest()[:8], 'big')
+        rng = random.Random(seed)
+        delay = self.latency_ms + (rng.random() * self.jitter_ms if self.jitter_ms else 0.0)
+        if delay:
+            time.sleep(delay / 1000.0)
+        if self.error_rate and rng.random() < self.error_rate:
+            raise RuntimeError(f"fake {self.model_name} error")
+        text = self._answer(prompt, rng)
+        if stream:
+            # uneven chunk boundaries, like the real stream
+            return [FakeResponse(text[i:i + 37]) for i in range(0, len(text), 37)]
+        return FakeResponse(text)
+
+    def _answer(self, prompt, rng):
+        if "MCQs" in prompt:
+            return json.dumps([
+                {
+                    "question": f"Question {i + 1}?",
+                    "options": ["A", "B", "C", "D"],
+                    "answer": rng.choice(["A", "B", "C", "D"]),
+                }
+                for i in range(5)
+            ])
+        if "JSON Lines" in prompt:
+            return "\n".join(json.dumps({
+                "day": d,
+                "focus": f"Topic {rng.randint(1, 99)}",
+                "tasks": [{"title": f"Task {d}.{t}", "details": "Work through examples."} for t in range(1, 4)],
+            }) for d in range(1, 8))
+        if "study planner" in prompt:
+            return "\n".join(f"- Day {d}: Study block {rng.randint(1, 99)}" for d in range(1, 8))
+        words = prompt.split()
+        return " ".join(rng.choice(words) for _ in range(min(60, len(words)))) or "Summary."
+
+
+class FakeModelFactory:
+    """Callable for GEMINI_MODEL_FACTORY; counts calls so runs can report them."""
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.calls = 0
+
+    def __call__(self, model_name):
+        self.calls += 1
+        return FakeModel(model_name, self.latency_ms, self.jitter_ms, self.error_rate)
@@ -0,0 +1,269 @@
+"""
+Offline benchmark suite for the Flask backend.
+
+Starts the app in-process against mongomock (default) or a local Mongo, with a
+deterministic Gemini stand-in, seeds synthetic users / files / planner data and
+load-tests the main endpoints plus the background checker. Prints (or writes)
+one JSON document with p50/p95/p99 latency and requests/s per scenario, so
+results can be diffed between versions.
+
+    cd backend
+    python -m bench.run --users 5 --requests 200 --concurrency 8 --output bench.json
+    python -m bench.run --mongo-uri mongodb://localhost:27017 --gemini-latency-ms 300
+
+mongomock is only needed when --mongo-uri is not given (pip install mongomock).
+"""
+import argparse
+import datetime
+import io
+import json
+import math
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+import jwt
+
+from backend_app import (
+    AIPlan, Alert, File, FileChat, PlannerEvent, PlannerTask, PlannerTombstone, User, VaultStats,
+    check_planner_deadlines, create_app,
+)
+from bench.corpus import build_corpus, planner_rows
+from bench.fake_gemini import FakeModelFactory
+
+SCENARIOS = ('upload', 'vault_list', 'summarize', 'chat', 'alerts', 'background_checker')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="MindVault backend benchmark")
+    parser.add_argument('--mongo-uri', help="Mongo URI; mongomock is used when omitted")
+    parser.add_argument('--db', default='mindvault_bench')
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--files-per-user', type=int, default=9)
+    parser.add_argument('--tasks-per-user', type=int, default=50)
+    parser.add_argument('--events-per-user', type=int, default=40)
+    parser.add_argument('--requests', type=int, default=200, help="requests per scenario")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--checker-ticks', type=int, default=20)
+    parser.add_argument('--gemini-latency-ms', type=float, default=50.0)
+    parser.add_argument('--gemini-jitter-ms', type=float, default=0.0)
+    parser.add_argument('--gemini-error-rate', type=float, default=0.0)
+    parser.add_argument('--sizes', default='small,medium,large')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--output', help="write JSON results here instead of stdout")
+    return parser.parse_args(argv)
+
+
+def mongo_settings(args):
+    if args.mongo_uri:
+        return {'db': args.db, 'host': args.mongo_uri}
+    try:
+        import mongomock
+    except ImportError:
+        sys.exit("mongomock is not installed; pass --mongo-uri or pip install mongomock")
+    return {'db': args.db, 'host': 'localhost', 'mongo_client_class': mongomock.MongoClient}
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    # ceil, not round(): round() goes half-to-even and lands one rank low.
+    # pct * n first, so 95 * 20 / 100 is exactly 19.0
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(pct * len(sorted_values) / 100.0) - 1))
+    return sorted_values[rank]
+
+
+def summarize(latencies, errors, elapsed):
+    latencies_ms = sorted(x * 1000.0 for x in latencies)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'elapsed_s': round(elapsed, 4),
+        'rps': round(len(latencies) / elapsed, 2) if elapsed else None,
+        'p50_ms': percentile(latencies_ms, 50),
+        'p95_ms': percentile(latencies_ms, 95),
+        'p99_ms': percentile(latencies_ms, 99),
+        'max_ms': latencies_ms[-1] if latencies_ms else None,
+    }
+
+
+def seed(app, args, corpus, rng):
+    """Create users with planner data and a few uploaded files each; return per-user contexts."""
+    password = bcrypt.hashpw(b'bench-password', bcrypt.gensalt(4)).decode('utf-8')
+    now = datetime.datetime.utcnow()
+    users = []
+    with app.app_context():
+        for model in (User, File, FileChat, PlannerTask, PlannerEvent, Alert,
+                      PlannerTombstone, AIPlan, VaultStats):
+            model.drop_collection()
+        for i in range(args.users):
+            user = User(firstName=f"Bench{i}", email=f"bench{i}@example.com", password=password).save()
+            task_rows, event_rows = planner_rows(rng, now, args.tasks_per_user, args.events_per_user)
+            PlannerTask.objects.insert([PlannerTask(user_id=user, **row) for row in task_rows], load_bulk=False)
+            PlannerEvent.objects.insert([PlannerEvent(user_id=user, **row) for row in event_rows], load_bulk=False)
+            token = jwt.encode(
+                {'user_id': str(user.id), 'exp': now + datetime.timedelta(hours=5)},
+                app.config['JWT_SECRET'], algorithm="HS256")
+            users.append({'token': token, 'file_ids': []})
+
+    client = app.test_client()
+    for ctx in users:
+        for name, data, mimetype in rng.sample(corpus, min(args.files_per_user, len(corpus))):
+            resp = client.post('/api/upload', headers=auth(ctx),
+                               data={'file': (io.BytesIO(data), name, mimetype), 'type': name.rsplit('.', 1)[1]},
+                               content_type='multipart/form-data')
+            ctx['file_ids'].append(resp.get_json()['fileId'])
+    return users
+
+
+def auth(ctx):
+    return {'Authorization': f"Bearer {ctx['token']}"}
+
+
+# ---------------- SCENARIOS ----------------
+def sc_upload(client, ctx, rng, corpus):
+    name, data, mimetype = rng.choice(corpus)
+    return client.post('/api/upload', headers=auth(ctx),
+                       data={'file': (io.BytesIO(data), name, mimetype), 'type': name.rsplit('.', 1)[1]},
+                       content_type='multipart/form-data')
+
+
+def sc_vault_list(client, ctx, rng, corpus):
+    return client.get('/api/vault/files', headers=auth(ctx))
+
+
+def sc_summarize(client, ctx, rng, corpus):
+    return client.get(f"/api/summarize/{rng.choice(ctx['file_ids'])}", headers=auth(ctx))
+
+
+def sc_chat(client, ctx, rng, corpus):
+    return client.post(f"/api/chat/{rng.choice(ctx['file_ids'])}/ask", headers=auth(ctx),
+                       json={'question': "What are the key ideas on page 3?"})
+
+
+def sc_alerts(client, ctx, rng, corpus):
+    return client.get('/api/planner/alerts', headers=auth(ctx))
+
+
+HTTP_SCENARIOS = {
+    'upload': sc_upload,
+    'vault_list': sc_vault_list,
+    'summarize': sc_summarize,
+    'chat': sc_chat,
+    'alerts': sc_alerts,
+}
+
+
+def run_http_scenario(app, fn, users, corpus, args):
+    local = threading.local()
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def one(i):
+        nonlocal errors
+        if not hasattr(local, 'client'):
+            local.client = app.test_client()
+        rng = random.Random(args.seed + i)
+        ctx = users[i % len(users)]
+        start = time.perf_counter()
+        resp = fn(local.client, ctx, rng, corpus)
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            if resp.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(one, range(args.requests)))
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+def run_checker_scenario(app, args):
+    latencies = []
+    errors = 0
+    start = time.perf_counter()
+    with app.app_context():
+        # like the real checker: the first tick scans the lookback window, later ones only what changed
+        since = None
+        for _ in range(args.checker_ticks):
+            tick = time.perf_counter()
+            try:
+                since = check_planner_deadlines(since=since)
+            except Exception as e:
+                print("checker tick failed:", e, file=sys.stderr)
+                errors += 1
+            latencies.append(time.perf_counter() - tick)
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    rng = random.Random(args.seed)
+    scenarios = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        sys.exit(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    corpus = build_corpus(sizes=[s.strip() for s in args.sizes.split(',') if s.strip()], seed=args.seed)
+    factory = FakeModelFactory(args.gemini_latency_ms, args.gemini_jitter_ms, args.gemini_error_rate)
+    vault_dir = tempfile.mkdtemp(prefix='mindvault-bench-')
+    derived_dir = tempfile.mkdtemp(prefix='mindvault-bench-derived-')
+    try:
+        app = create_app({
+            'MONGODB_SETTINGS': mongo_settings(args),
+            'VAULT_FOLDER': vault_dir,
+            'DERIVED_FOLDER': derived_dir,
+            'GEMINI_MODEL_FACTORY': factory,
+            'TESTING': True,
+        }, start_background=False)
+        users = seed(app, args, corpus, rng)
+
+        results = {}
+        for name in scenarios:
+            if name == 'background_checker':
+                results[name] = run_checker_scenario(app, args)
+            else:
+                results[name] = run_http_scenario(app, HTTP_SCENARIOS[name], users, corpus, args)
+
+        report = {
+            'version': git_revision(),
+            'timestamp': datetime.datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'backend': 'mongo' if args.mongo_uri else 'mongomock',
+            'params': {k: v for k, v in vars(args).items() if k != 'output'},
+            'corpus_bytes': {name: len(data) for name, data, _ in corpus},
+            'gemini_calls': factory.calls,
+            'scenarios': results,
+        }
+    finally:
+        shutil.rmtree(vault_dir, ignore_errors=True)
+        shutil.rmtree(derived_dir, ignore_errors=True)
+
+    out = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(out + "\n")
+    else:
+        print(out)
+
+
+if __name__ == '__main__':
+    main()
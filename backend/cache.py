@@ -0,0 +1,51 @@
+"""
+Small in-process caches.
+
+PerUserCache keeps short-lived results per user and drops everything a user has
+cached in one call (invalidate) whenever that user's data is written. It is
+per worker process: the TTL bounds how stale another worker can be.
+"""
+import collections
+import threading
+import time
+
+import metrics
+
+
+class PerUserCache:
+    def __init__(self, name, ttl=15.0, max_users=10000):
+        self.name = name
+        self.ttl = ttl
+        self.max_users = max_users
+        # user_id -> (expires_at, {key: value}); ordered for LRU eviction
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            value = None
+            if entry is not None:
+                if entry[0] <= now:
+                    del self._entries[user_id]
+                else:
+                    value = entry[1].get(key)
+                    self._entries.move_to_end(user_id)
+        metrics.record_cache(self.name, value is not None)
+        return value
+
+    def set(self, user_id, key, value):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] <= now:
+                entry = self._entries[user_id] = (now + self.ttl, {})
+            entry[1][key] = value
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
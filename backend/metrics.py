@@ -0,0 +1,334 @@
+"""
+Lightweight in-process metrics for the Flask backend.
+
+Counters and fixed-bucket histograms kept in plain dicts behind a lock, rendered
+in the Prometheus text format at /metrics. Cheap enough to leave on in
+production: an observation is one bisect plus a couple of integer increments.
+
+Under a pre-fork server (gunicorn -w N) every worker has its own counters. Set
+METRICS_MULTIPROC_DIR and each worker spools its totals to a file there, so
+whichever worker answers a scrape reports the sum over all of them (see
+MultiprocessSpool). /metrics requires ADMIN_TOKEN (see admin.py).
+"""
+import atexit
+import bisect
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, current_app, g, request
+
+import admin
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = [f'{k}="{_escape(v)}"' for k, v in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, '') for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(labels.get(n, '') for n in self.labelnames)
+        return self._values.get(key, 0)
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def render(self, others=()):
+        """others: snapshot() lists from other processes, summed into the output."""
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            merged = dict(self._values)
+        for snapshot in others:
+            for key, value in snapshot:
+                key = tuple(key)
+                merged[key] = merged.get(key, 0) + value
+        for key, value in merged.items():
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # label key -> [per-bucket counts (+Inf last), sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, '') for n in self.labelnames)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][idx] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), list(entry[0]), entry[1], entry[2]] for key, entry in self._values.items()]
+
+    def render(self, others=()):
+        """others: snapshot() lists from other processes, summed into the output."""
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            merged = {key: [list(entry[0]), entry[1], entry[2]] for key, entry in self._values.items()}
+        for snapshot in others:
+            for key, counts, total, count in snapshot:
+                if len(counts) != len(self.buckets) + 1:
+                    continue  # written by a build with different buckets
+                entry = merged.setdefault(tuple(key), [[0] * (len(self.buckets) + 1), 0.0, 0])
+                entry[0] = [a + b for a, b in zip(entry[0], counts)]
+                entry[1] += total
+                entry[2] += count
+        for key, (counts, total, count) in merged.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                le_label = f'le="{le}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, le_label)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {total}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {count}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help_text, labelnames=()):
+        metric = Counter(name, help_text, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help_text, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def snapshot(self):
+        return {metric.name: metric.snapshot() for metric in self._metrics}
+
+    def render(self, others=()):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render([o[metric.name] for o in others if metric.name in o]))
+        return '\n'.join(lines) + '\n'
+
+
+class MultiprocessSpool:
+    """
+    Cross-worker totals for pre-fork servers. Each process writes its registry
+    snapshot to <directory>/metrics-<pid>-<start>.json every `interval` seconds
+    (and on each scrape); a scrape sums its own live values with every other
+    file. Files of exited workers are kept so totals never go backwards, which
+    means the directory must be emptied when the whole server restarts (same
+    contract as prometheus_client's multiprocess mode). Other workers' values
+    lag by at most `interval`.
+    """
+
+    def __init__(self, registry, directory, interval=5.0):
+        self.registry = registry
+        self.directory = directory
+        self.interval = interval
+        self._pid = None
+        self._path = None
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def ensure_started(self):
+        """Start this process's flusher; a no-op after the first call in each (forked) process."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._path = os.path.join(self.directory, f"metrics-{self._pid}-{time.time_ns()}.json")
+            threading.Thread(target=self._run, daemon=True, name='MetricsSpool').start()
+            atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️ metrics spool flush failed: {e}")
+
+    def flush(self):
+        if self._path is None:
+            return
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='.metrics-')
+        with os.fdopen(fd, 'w') as out:
+            json.dump(self.registry.snapshot(), out)
+        os.replace(tmp, self._path)
+
+    def others(self):
+        snapshots = []
+        for path in glob.glob(os.path.join(self.directory, 'metrics-*.json')):
+            if path == self._path:
+                continue
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue  # removed or replaced under us
+        return snapshots
+
+    def render(self):
+        self.ensure_started()
+        self.flush()
+        return self.registry.render(self.others())
+
+
+REGISTRY = Registry()
+
+# ---------------- METRIC DEFINITIONS ----------------
+HTTP_REQUESTS = REGISTRY.counter(
+    'mindvault_http_requests_total', 'HTTP requests by route and status.',
+    ('method', 'route', 'status'))
+HTTP_LATENCY = REGISTRY.histogram(
+    'mindvault_http_request_duration_seconds', 'HTTP request latency by route.',
+    ('method', 'route'))
+
+MONGO_COMMANDS = REGISTRY.counter(
+    'mindvault_mongo_commands_total', 'MongoDB commands by command, collection and outcome.',
+    ('command', 'collection', 'outcome'))
+MONGO_LATENCY = REGISTRY.histogram(
+    'mindvault_mongo_command_duration_seconds', 'MongoDB command latency.',
+    ('command', 'collection'),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+
+SCOPE_QUERIES = REGISTRY.histogram(
+    'mindvault_mongo_queries_per_scope', 'MongoDB commands issued per request / job tick.',
+    ('scope',),
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 250))
+SCOPE_QUERY_TIME = REGISTRY.histogram(
+    'mindvault_mongo_time_per_scope_seconds', 'MongoDB time spent per request / job tick.',
+    ('scope',),
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+REPEATED_QUERIES = REGISTRY.counter(
+    'mindvault_mongo_repeated_queries_total', 'Scopes that repeated one query shape (likely N+1).',
+    ('scope',))
+
+EXTRACTION_LATENCY = REGISTRY.histogram(
+    'mindvault_extraction_duration_seconds', 'Text extraction time by file type and size class.',
+    ('file_type', 'size_class'))
+
+GEMINI_REQUESTS = REGISTRY.counter(
+    'mindvault_gemini_requests_total', 'Gemini generate_content calls by model and outcome.',
+    ('model', 'outcome'))
+GEMINI_LATENCY = REGISTRY.histogram(
+    'mindvault_gemini_request_duration_seconds', 'Gemini generate_content latency by model.',
+    ('model',),
+    buckets=(0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0, 60.0))
+
+PASSWORD_HASHES = REGISTRY.counter(
+    'mindvault_password_hashes_total', 'bcrypt operations by op and outcome (ok/rejected/timeout).',
+    ('op', 'outcome'))
+PASSWORD_HASH_LATENCY = REGISTRY.histogram(
+    'mindvault_password_hash_duration_seconds', 'bcrypt latency including pool wait.',
+    ('op',),
+    buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 2.0, 5.0))
+
+CACHE_REQUESTS = REGISTRY.counter(
+    'mindvault_cache_requests_total', 'Cache lookups by cache name and result (hit/miss).',
+    ('cache', 'result'))
+
+
+def size_class(num_bytes):
+    """Coarse size label for extraction metrics (keeps label cardinality small)."""
+    if num_bytes < 100 * 1024:
+        return 'lt_100k'
+    if num_bytes < 1024 * 1024:
+        return 'lt_1m'
+    if num_bytes < 10 * 1024 * 1024:
+        return 'lt_10m'
+    return 'ge_10m'
+
+
+def record_cache(cache, hit):
+    CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
+
+
+# ---------------- FLASK INTEGRATION ----------------
+def _before_request():
+    spool = current_app.extensions.get('metrics_spool')
+    if spool is not None:
+        # first request in each worker: gunicorn forks after create_app, and
+        # threads don't survive a fork
+        spool.ensure_started()
+    g._metrics_start = time.perf_counter()
+
+
+def _after_request(response):
+    start = g.pop('_metrics_start', None)
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        HTTP_REQUESTS.inc(method=request.method, route=route, status=response.status_code)
+        HTTP_LATENCY.observe(time.perf_counter() - start, method=request.method, route=route)
+    return response
+
+
+@admin.admin_required
+def metrics_view():
+    spool = current_app.extensions.get('metrics_spool')
+    body = spool.render() if spool is not None else REGISTRY.render()
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    """
+    Wire per-route timing and the /metrics endpoint into app. MONGO_COMMANDS /
+    MONGO_LATENCY are fed by the command listener in query_accounting.py.
+    """
+    if not app.config.get('METRICS_ENABLED', True):
+        return
+    if app.config.get('METRICS_MULTIPROC_DIR'):
+        app.extensions['metrics_spool'] = MultiprocessSpool(
+            REGISTRY, app.config['METRICS_MULTIPROC_DIR'], app.config.get('METRICS_SPOOL_INTERVAL', 5.0))
+        # also covers processes that only run background jobs and never serve a request
+        app.extensions['metrics_spool'].ensure_started()
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view, methods=['GET'])
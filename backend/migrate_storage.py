@@ -0,0 +1,77 @@
+"""
+Move vault files stored as absolute paths (the old flat MY_VAULT_FOLDER layout)
+into the configured storage backend (sharded local dirs or S3, see storage.py).
+
+    cd backend
+    python migrate_storage.py --dry-run
+    python migrate_storage.py                 # migrate, delete the old copies
+    python migrate_storage.py --keep-source   # migrate, leave old files in place
+
+Safe to re-run: each File is switched to its new key with a conditional update
+only after its blob has been written, and already-migrated files are skipped.
+"""
+import argparse
+import os
+
+import storage
+from backend_app import File, create_app, vault_storage
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Migrate vault files into the storage backend")
+    parser.add_argument('--dry-run', action='store_true', help="only report what would move")
+    parser.add_argument('--keep-source', action='store_true', help="don't delete the old files")
+    parser.add_argument('--batch-size', type=int, default=500)
+    return parser.parse_args(argv)
+
+
+def migrate(dry_run=False, keep_source=False, batch_size=500):
+    store = vault_storage()
+    moved = missing = skipped = 0
+    stored_bytes = original_bytes = 0
+    last_id = None
+    while True:
+        query = File.objects.only('id', 'file_id', 'storage_path').order_by('id')
+        if last_id is not None:
+            query = query.filter(id__gt=last_id)
+        batch = list(query.limit(batch_size).as_pymongo())
+        if not batch:
+            break
+        last_id = batch[-1]['_id']
+        for doc in batch:
+            old_path = doc['storage_path']
+            if not storage.is_legacy(old_path):
+                skipped += 1
+                continue
+            if not os.path.exists(old_path):
+                print(f"⚠️ missing on disk: {doc['file_id']} ({old_path})")
+                missing += 1
+                continue
+            new_key = storage.shard_key(doc['file_id'], os.path.splitext(old_path)[1])
+            if dry_run:
+                print(f"would move {old_path} -> {new_key}")
+                moved += 1
+                continue
+            codec = store.codec_for(new_key).suffix
+            with open(old_path, 'rb') as src:
+                size, stored = store.save(new_key, src)
+            updated = File.objects(id=doc['_id'], storage_path=old_path).update_one(
+                set__storage_path=new_key, set__storage_codec=codec)
+            if not updated:
+                # changed concurrently (e.g. deleted); leave the old file alone
+                store.delete(new_key, codec)
+                continue
+            if not keep_source:
+                os.remove(old_path)
+            moved += 1
+            original_bytes += size
+            stored_bytes += stored
+    print(f"moved={moved} missing={missing} already_migrated={skipped} "
+          f"bytes_before={original_bytes} bytes_after={stored_bytes}")
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    app = create_app(start_background=False)
+    with app.app_context():
+        migrate(args.dry_run, args.keep_source, args.batch_size)
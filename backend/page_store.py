@@ -0,0 +1,138 @@
+"""
+Page-addressable extracted text.
+
+Each vault file gets one derived file under DERIVED_FOLDER, sharded like the
+vault itself (storage.shard_key), with this layout (little-endian):
+
+    magic    4 bytes   b"MVPT"
+    version  uint16
+    reserved uint16
+    count    uint32    number of pages (PDF pages / PPTX slides; a TXT file is one page)
+    offsets  (count + 1) x uint64, byte offset of each page into the text block
+    text     UTF-8 page texts back to back
+
+Files are memory-mapped on read: page N is two offset lookups and one slice
+however large the document is. The PDF/PPTX is parsed once, in the
+background after upload (or on first use if the file is missing).
+"""
+import mmap
+import os
+import re
+import struct
+import tempfile
+
+import storage
+
+MAGIC = b'MVPT'
+VERSION = 1
+_HEADER = struct.Struct('<4sHHI')
+_OFFSET = struct.Struct('<Q')
+_SPAN = struct.Struct('<QQ')
+
+# "page 12", "pages 3-5", "pages 3 to 5", "p. 7", "pp. 3-5", "slide 40", "slides 2-4"
+_PAGE_REF = re.compile(
+    r'\b(?P<kind>pages?|slides?|pp?\.)\s*(?P<first>\d{1,5})'
+    r'(?:\s*(?:-|–|to|through)\s*(?P<last>\d{1,5}))?',
+    re.IGNORECASE,
+)
+
+
+def page_references(text, max_pages=10):
+    """1-based page/slide numbers referenced in text, in order, at most max_pages."""
+    numbers = []
+    for match in _PAGE_REF.finditer(text):
+        first = int(match.group('first'))
+        last = int(match.group('last') or first)
+        if last < first:
+            first, last = last, first
+        for n in range(max(first, 1), last + 1):
+            if n not in numbers:
+                numbers.append(n)
+            if len(numbers) >= max_pages:
+                return numbers
+    return numbers
+
+
+class PageText:
+    """Read-only, memory-mapped view of one page text file. Pages are 1-based."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, _, count = _HEADER.unpack_from(self._mm, 0)
+        except struct.error:
+            magic, version, count = None, None, 0
+        if magic != MAGIC or version != VERSION:
+            self._mm.close()
+            raise ValueError(f"not a page text file (v{VERSION}): {path}")
+        self.page_count = count
+        self._table = _HEADER.size
+        self._text = _HEADER.size + (count + 1) * _OFFSET.size
+
+    def page(self, number):
+        if not 1 <= number <= self.page_count:
+            raise IndexError(f"page {number} of {self.page_count}")
+        start, end = _SPAN.unpack_from(self._mm, self._table + (number - 1) * _OFFSET.size)
+        return self._mm[self._text + start:self._text + end].decode('utf-8')
+
+    def pages(self, first, last):
+        """Pages first..last inclusive, clipped to the document."""
+        return [self.page(n) for n in range(max(first, 1), min(last, self.page_count) + 1)]
+
+    def close(self):
+        self._mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_pages(path, pages):
+    """Write pages (list of str) to path atomically in the format above."""
+    encoded = [p.encode('utf-8', errors='replace') for p in pages]
+    offsets = [0]
+    for data in encoded:
+        offsets.append(offsets[-1] + len(data))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.pages-')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            out.write(_HEADER.pack(MAGIC, VERSION, 0, len(encoded)))
+            out.write(struct.pack(f'<{len(offsets)}Q', *offsets))
+            for data in encoded:
+                out.write(data)
+        os.replace(tmp, path)
+    except Exception:
+        os.remove(tmp)
+        raise
+
+
+class PageStore:
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, file_id):
+        return os.path.join(self.root, *storage.shard_key(file_id, '.pages').split('/'))
+
+    def open(self, file_id):
+        """PageText for file_id, or None if it hasn't been built (or is from an older format)."""
+        path = self.path(file_id)
+        if not os.path.exists(path):
+            return None
+        try:
+            return PageText(path)
+        except ValueError:
+            return None
+
+    def build(self, file_id, pages):
+        write_pages(self.path(file_id), pages)
+        return PageText(self.path(file_id))
+
+    def delete(self, file_id):
+        try:
+            os.remove(self.path(file_id))
+        except FileNotFoundError:
+            pass
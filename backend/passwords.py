@@ -0,0 +1,121 @@
+"""
+Password hashing off the request threads.
+
+bcrypt is CPU-bound (and releases the GIL), so a login burst can occupy every
+Flask worker thread. PasswordHasher runs hashes on a small dedicated pool:
+at most `workers` hashes run at once and at most `max_pending` more may wait;
+anything beyond that raises HashPoolBusy immediately so the route can answer
+429 instead of queueing.
+
+The request thread still blocks while its hash runs or waits, so the
+admission cap (workers + max_pending) must stay below the request threads of
+the process, or a login burst can still take all of them. Pass
+request_threads (SERVER_THREADS, e.g. gunicorn --threads) and the cap is
+clamped to request_threads - 1. Waiting is bounded by `timeout` as well.
+
+The cost factor is BCRYPT_ROUNDS, or calibrated once against BCRYPT_TARGET_MS
+at startup (create_app calls calibrate(), which runs on the pool). With
+BCRYPT_ROUNDS set, hashes of any other cost are re-hashed on the next
+successful login; a calibrated cost only upgrades weaker hashes, so workers
+that calibrated slightly differently never flip a hash back and forth.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+import bcrypt
+
+import metrics
+
+MIN_ROUNDS = 10
+MAX_ROUNDS = 16
+
+
+class HashPoolBusy(Exception):
+    """Too many hashes in flight; retry later."""
+
+
+def hash_rounds(hashed):
+    """Cost factor of a '$2b$12$...' hash, or None if unparsable."""
+    try:
+        return int(hashed.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def calibrate_rounds(target_ms, min_rounds=MIN_ROUNDS, max_rounds=MAX_ROUNDS):
+    """Largest cost whose hash takes at most target_ms here (never below min_rounds)."""
+    rounds = min_rounds
+    while rounds < max_rounds:
+        start = time.perf_counter()
+        bcrypt.hashpw(b'calibration-password', bcrypt.gensalt(rounds))
+        elapsed_ms = (time.perf_counter() - start) * 1000.0
+        # each extra round doubles the cost
+        if elapsed_ms * 2 > target_ms:
+            break
+        rounds += 1
+    return rounds
+
+
+class PasswordHasher:
+    def __init__(self, rounds=None, target_ms=None, workers=2, max_pending=1, timeout=2.0,
+                 request_threads=None):
+        self.pinned = rounds is not None
+        self._rounds = rounds if rounds is not None or target_ms else 12
+        self.target_ms = target_ms
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bcrypt')
+        slots = workers + max_pending
+        if request_threads:
+            # leave at least one request thread for everything that isn't a login
+            slots = min(slots, max(1, request_threads - 1))
+        self.slots = slots
+        self._slots = threading.BoundedSemaphore(slots)
+        self._calibrate_lock = threading.Lock()
+
+    def calibrate(self):
+        """Fix the cost factor now (once), timing it on the hash pool rather than a request thread."""
+        if self._rounds is None:
+            with self._calibrate_lock:
+                if self._rounds is None:
+                    self._rounds = self._pool.submit(calibrate_rounds, self.target_ms).result()
+                    print(f"bcrypt cost factor: {self._rounds}")
+        return self._rounds
+
+    @property
+    def rounds(self):
+        return self._rounds if self._rounds is not None else self.calibrate()
+
+    def _run(self, op, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            metrics.PASSWORD_HASHES.inc(op=op, outcome='rejected')
+            raise HashPoolBusy()
+        start = time.perf_counter()
+        try:
+            future = self._pool.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            result = future.result(timeout=self.timeout)
+        except FutureTimeout:
+            metrics.PASSWORD_HASHES.inc(op=op, outcome='timeout')
+            raise HashPoolBusy()
+        metrics.PASSWORD_HASHES.inc(op=op, outcome='ok')
+        metrics.PASSWORD_HASH_LATENCY.observe(time.perf_counter() - start, op=op)
+        return result
+
+    def hash(self, password):
+        salt = bcrypt.gensalt(self.rounds)
+        return self._run('hash', bcrypt.hashpw, password.encode('utf-8'), salt).decode('utf-8')
+
+    def verify(self, password, hashed):
+        return self._run('verify', bcrypt.checkpw, password.encode('utf-8'), hashed.encode('utf-8'))
+
+    def needs_rehash(self, hashed):
+        current = hash_rounds(hashed)
+        if current is None:
+            return True
+        return current != self.rounds if self.pinned else current < self.rounds
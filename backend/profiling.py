@@ -0,0 +1,323 @@
+"""
+Opt-in per-request profiling and slow-request capture.
+
+A request is profiled when any of these triggers fires:
+
+- header:  X-MindVault-Profile matches PROFILE_TOKEN  -> cProfile
+- sample:  random() < PROFILE_SAMPLE_RATE              -> cProfile
+- slow:    PROFILE_SLOW_MS is set                      -> stack sampler, kept
+           only if the request took at least that long
+
+Each captured request stores its profile plus the Mongo commands it issued in a
+bounded ring buffer (PROFILE_BUFFER_SIZE), downloadable from /api/admin/profiles
+with ADMIN_TOKEN (see admin.py). The buffer is per process unless PROFILE_DIR
+is set, in which case all workers of a pre-fork server share it on disk.
+Nothing is captured unless one of the triggers is configured.
+"""
+import base64
+import collections
+import cProfile
+import datetime
+import glob
+import io
+import itertools
+import json
+import marshal
+import os
+import pstats
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+from flask import Response, current_app, g, jsonify, request
+
+import admin
+import query_accounting
+
+PROFILE_HEADER = 'X-MindVault-Profile'
+
+
+# ---------------- RING BUFFER ----------------
+class ProfileStore:
+    """Most recent N captured profiles, oldest evicted first."""
+
+    def __init__(self, size):
+        self._items = collections.deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, record):
+        with self._lock:
+            self._items.append(record)
+
+    def list(self):
+        with self._lock:
+            return list(reversed(self._items))
+
+    def get(self, profile_id):
+        with self._lock:
+            for record in self._items:
+                if record['id'] == profile_id:
+                    return record
+        return None
+
+
+class SpoolProfileStore:
+    """
+    Same interface, kept as one JSON file per profile in a directory shared by
+    all workers, so list and download work whichever worker answers. Oldest
+    files beyond `size` are removed on add.
+    """
+
+    _ID = re.compile(r'^[0-9a-f]{32}$')
+
+    def __init__(self, directory, size):
+        self.directory = directory
+        self.size = size
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, profile_id):
+        return os.path.join(self.directory, f"{profile_id}.json")
+
+    def _files(self):
+        """Profile files, newest first."""
+        entries = []
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except OSError:
+                continue
+        return [path for _, path in sorted(entries, reverse=True)]
+
+    @staticmethod
+    def _load(path):
+        try:
+            with open(path) as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        record['raw'] = base64.b64decode(record['raw'])
+        return record
+
+    def add(self, record):
+        data = dict(record, raw=base64.b64encode(record['raw']).decode('ascii'))
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='.profile-')
+        with os.fdopen(fd, 'w') as out:
+            json.dump(data, out)
+        os.replace(tmp, self._path(record['id']))
+        for path in self._files()[self.size:]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def list(self):
+        return [r for r in (self._load(p) for p in self._files()) if r is not None]
+
+    def get(self, profile_id):
+        if not self._ID.match(profile_id):
+            return None
+        return self._load(self._path(profile_id))
+
+
+# ---------------- STACK SAMPLER ----------------
+class StackSampler:
+    """
+    One background thread sampling the stacks of registered request threads.
+    Cheap enough to run on every request when slow-request capture is on; the
+    thread idles when nothing is registered.
+    """
+
+    def __init__(self, interval=0.005, max_depth=64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self._targets = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def start(self, thread_id):
+        counts = collections.Counter()
+        with self._lock:
+            self._targets[thread_id] = counts
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True, name='ProfileSampler')
+                self._thread.start()
+        self._wakeup.set()
+        return counts
+
+    def stop(self, thread_id):
+        with self._lock:
+            return self._targets.pop(thread_id, None)
+
+    def _collapse(self, frame):
+        parts = []
+        while frame is not None and len(parts) < self.max_depth:
+            code = frame.f_code
+            parts.append(f"{code.co_filename}:{code.co_name}:{frame.f_lineno}")
+            frame = frame.f_back
+        return ';'.join(reversed(parts))
+
+    def _run(self):
+        while True:
+            with self._lock:
+                targets = dict(self._targets)
+            if not targets:
+                self._wakeup.clear()
+                self._wakeup.wait()
+                continue
+            frames = sys._current_frames()
+            for thread_id, counts in targets.items():
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    counts[self._collapse(frame)] += 1
+            del frames
+            time.sleep(self.interval)
+
+
+# cProfile can only be active once per process on newer Pythons (sys.monitoring);
+# concurrent profiled requests fall back to the sampler.
+_cprofile_lock = threading.Lock()
+
+
+def _choose_trigger(config):
+    if admin.token_matches(config.get('PROFILE_TOKEN'), request.headers.get(PROFILE_HEADER)):
+        return 'header'
+    rate = config.get('PROFILE_SAMPLE_RATE') or 0.0
+    if rate and random.random() < rate:
+        return 'sample'
+    if config.get('PROFILE_SLOW_MS') is not None:
+        return 'slow'
+    return None
+
+
+def _before_request():
+    config = current_app.config
+    trigger = _choose_trigger(config)
+    if trigger is None:
+        return
+    state = {'trigger': trigger, 'start': time.perf_counter(), 'profiler': None, 'samples': None}
+    if trigger in ('header', 'sample') and _cprofile_lock.acquire(blocking=False):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            state['profiler'] = profiler
+        except ValueError:
+            _cprofile_lock.release()
+    if state['profiler'] is None:
+        state['samples'] = current_app.extensions['profiling_sampler'].start(threading.get_ident())
+    state['queries'] = query_accounting.start('profile', capture=True)
+    g._profile_state = state
+
+
+def _stop(state):
+    profiler = state['profiler']
+    if profiler is not None:
+        profiler.disable()
+        _cprofile_lock.release()
+    else:
+        current_app.extensions['profiling_sampler'].stop(threading.get_ident())
+    return query_accounting.stop(state['queries']).queries
+
+
+def _after_request(response):
+    state = g.pop('_profile_state', None)
+    if state is None:
+        return response
+    duration_ms = (time.perf_counter() - state['start']) * 1000.0
+    queries = _stop(state)
+
+    try:
+        _record(state, response, duration_ms, queries)
+    except Exception as e:
+        # profiling must never turn the user's request into an error
+        print(f"⚠️ profiling: could not record {request.path}: {e}")
+    return response
+
+
+def _record(state, response, duration_ms, queries):
+    slow_ms = current_app.config.get('PROFILE_SLOW_MS')
+    if state['trigger'] == 'slow' and duration_ms < slow_ms:
+        return
+
+    record = {
+        'id': uuid.uuid4().hex,
+        'trigger': state['trigger'],
+        'method': request.method,
+        'path': request.path,
+        'route': request.url_rule.rule if request.url_rule else None,
+        'status': response.status_code,
+        'duration_ms': round(duration_ms, 3),
+        'captured_at': datetime.datetime.utcnow().isoformat(),
+        'mongo': {
+            'count': len(queries),
+            'total_ms': round(sum(q['duration_ms'] or 0.0 for q in queries), 3),
+            'queries': queries,
+        },
+    }
+    if state['profiler'] is not None:
+        state['profiler'].create_stats()
+        record['kind'] = 'cprofile'
+        record['raw'] = marshal.dumps(state['profiler'].stats)
+        out = io.StringIO()
+        pstats.Stats(state['profiler'], stream=out).sort_stats('cumulative').print_stats(40)
+        record['summary'] = out.getvalue()
+    else:
+        # an empty Counter is falsy: test for None, not truthiness
+        samples = state['samples'] if state['samples'] is not None else collections.Counter()
+        record['kind'] = 'sampled'
+        record['raw'] = '\n'.join(f"{stack} {n}" for stack, n in samples.most_common()).encode('utf-8')
+        record['summary'] = '\n'.join(
+            f"{n:6d}  {stack.rsplit(';', 1)[-1]}" for stack, n in itertools.islice(samples.most_common(), 40))
+    current_app.extensions['profiling_store'].add(record)
+
+
+def _teardown_request(exc):
+    # after_request is skipped when the response itself fails; don't leak the profiler
+    state = g.pop('_profile_state', None)
+    if state is not None:
+        _stop(state)
+
+
+# ---------------- ADMIN ENDPOINTS ----------------
+def _public(record):
+    return {k: v for k, v in record.items() if k not in ('raw', 'summary', 'mongo')} | {
+        'mongo_count': record['mongo']['count'],
+        'mongo_ms': record['mongo']['total_ms'],
+    }
+
+
+@admin.admin_required
+def list_profiles():
+    store = current_app.extensions['profiling_store']
+    return jsonify({'profiles': [_public(r) for r in store.list()]})
+
+
+@admin.admin_required
+def get_profile(profile_id):
+    record = current_app.extensions['profiling_store'].get(profile_id)
+    if not record:
+        return jsonify({'error': 'Not found'}), 404
+    if request.args.get('download'):
+        # .prof loads with pstats / snakeviz; sampled stacks are flamegraph.pl "collapsed" format
+        ext = 'prof' if record['kind'] == 'cprofile' else 'collapsed.txt'
+        return Response(record['raw'], mimetype='application/octet-stream', headers={
+            'Content-Disposition': f"attachment; filename=profile-{record['id']}.{ext}"})
+    return jsonify({k: v for k, v in record.items() if k != 'raw'})
+
+
+def init_app(app):
+    app.config.setdefault('PROFILE_BUFFER_SIZE', 50)
+    if app.config.get('PROFILE_DIR'):
+        app.extensions['profiling_store'] = SpoolProfileStore(app.config['PROFILE_DIR'], app.config['PROFILE_BUFFER_SIZE'])
+    else:
+        app.extensions['profiling_store'] = ProfileStore(app.config['PROFILE_BUFFER_SIZE'])
+    app.extensions['profiling_sampler'] = StackSampler(app.config.get('PROFILE_SAMPLE_INTERVAL', 0.005))
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    app.add_url_rule('/api/admin/profiles', 'list_profiles', list_profiles, methods=['GET'])
+    app.add_url_rule('/api/admin/profiles/<profile_id>', 'get_profile', get_profile, methods=['GET'])
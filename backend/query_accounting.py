@@ -0,0 +1,279 @@
+"""
+Per-request / per-job MongoDB query accounting and N+1 detection.
+
+The process's one pymongo CommandListener times every command for the
+mindvault_mongo_* metrics and attributes it to the trackers active on the
+issuing thread (pymongo runs listeners synchronously on that thread):
+
+- each Flask request is tracked automatically (see init_app)
+- background jobs wrap a tick in ``with track('planner_checker'):``
+- tests assert budgets with ``with query_budget(max_queries=3): ...``
+
+When the same query shape (command + collection + filter keys, values dropped)
+repeats N_PLUS_ONE_THRESHOLD times inside one scope it is flagged in the log and
+in the mindvault_mongo_repeated_queries_total metric.
+"""
+import collections
+import threading
+from contextlib import contextmanager
+
+from flask import current_app, g, request
+from pymongo import monitoring
+
+import metrics
+
+N_PLUS_ONE_THRESHOLD = 5
+MAX_CAPTURED_QUERIES = 500
+
+_local = threading.local()
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryAccountingUnavailable(RuntimeError):
+    """The command listener isn't seeing this client's queries (see query_budget)."""
+
+
+def redact(value):
+    """Keep the query shape, drop the values (filters can hold emails, tokens...)."""
+    if isinstance(value, dict):
+        return {k: redact(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(v) for v in value[:3]]
+    return type(value).__name__
+
+
+def _filter_of(command_name, command):
+    if command_name in ('find', 'count', 'distinct', 'findAndModify'):
+        return command.get('filter') or command.get('query') or {}
+    if command_name == 'aggregate':
+        return [list(stage)[0] for stage in command.get('pipeline', []) if stage]
+    if command_name == 'update':
+        return (command.get('updates') or [{}])[0].get('q', {})
+    if command_name == 'delete':
+        return (command.get('deletes') or [{}])[0].get('q', {})
+    return {}
+
+
+def _keys(value):
+    if isinstance(value, dict):
+        return '{' + ','.join(f"{k}:{_keys(v)}" for k, v in sorted(value.items())) + '}'
+    if isinstance(value, list) and value and all(isinstance(v, str) for v in value):
+        return '[' + ','.join(value) + ']'
+    return '?'
+
+
+def query_shape(command_name, collection, command):
+    return f"{command_name} {collection} {_keys(_filter_of(command_name, command))}"
+
+
+def _docs_in_reply(reply):
+    cursor = reply.get('cursor')
+    if isinstance(cursor, dict):
+        return len(cursor.get('firstBatch') or cursor.get('nextBatch') or [])
+    n = reply.get('n')
+    return n if isinstance(n, int) else 0
+
+
+class QueryStats:
+    """Counters for one scope (a request or a job tick)."""
+
+    def __init__(self, scope, capture=False):
+        self.scope = scope
+        self.count = 0
+        self.total_ms = 0.0
+        # documents returned / affected; documents *scanned* is only visible to
+        # the server profiler or explain(), not to a command listener
+        self.docs = 0
+        self.shapes = collections.Counter()
+        self.queries = [] if capture else None
+
+    def repeated(self, threshold=N_PLUS_ONE_THRESHOLD):
+        return {shape: n for shape, n in self.shapes.items() if n >= threshold}
+
+    def as_dict(self):
+        return {
+            'scope': self.scope,
+            'count': self.count,
+            'total_ms': round(self.total_ms, 3),
+            'docs': self.docs,
+            'repeated': self.repeated(),
+        }
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Parses each command once, then feeds the metrics and every active QueryStats."""
+
+    def __init__(self):
+        self.record_metrics = False
+        # commands seen by this process; 0 means the client doesn't emit events
+        self.events = 0
+
+    def started(self, event):
+        self.events += 1
+        active = list(getattr(_local, 'active', None) or ())
+        if not active and not self.record_metrics:
+            return
+        command = event.command
+        collection = command.get(event.command_name)
+        if not isinstance(collection, str):
+            # getMore carries the cursor id under its name and the collection separately
+            collection = command.get('collection', '')
+        entries = []
+        if active:
+            shape = query_shape(event.command_name, collection, command)
+            for stats in active:
+                stats.count += 1
+                stats.shapes[shape] += 1
+                if stats.queries is not None and len(stats.queries) < MAX_CAPTURED_QUERIES:
+                    entry = {
+                        'command': event.command_name,
+                        'collection': collection,
+                        'filter': redact(_filter_of(event.command_name, command)),
+                        'duration_ms': None,
+                        'docs': None,
+                    }
+                    stats.queries.append(entry)
+                    entries.append(entry)
+        if not hasattr(_local, 'pending'):
+            _local.pending = {}
+        _local.pending[(event.connection_id, event.request_id)] = (collection, active, entries)
+
+    def _finish(self, event, reply):
+        pending = getattr(_local, 'pending', {}).pop((event.connection_id, event.request_id), None)
+        if pending is None:
+            return
+        collection, active, entries = pending
+        if self.record_metrics:
+            metrics.MONGO_COMMANDS.inc(
+                command=event.command_name, collection=collection, outcome='ok' if reply is not None else 'error')
+            metrics.MONGO_LATENCY.observe(
+                event.duration_micros / 1e6, command=event.command_name, collection=collection)
+        if not active:
+            return
+        duration_ms = event.duration_micros / 1000.0
+        docs = _docs_in_reply(reply) if reply else 0
+        for stats in active:
+            stats.total_ms += duration_ms
+            stats.docs += docs
+        for entry in entries:
+            entry['duration_ms'] = duration_ms
+            entry['docs'] = docs
+            entry['ok'] = reply is not None
+
+    def succeeded(self, event):
+        self._finish(event, event.reply)
+
+    def failed(self, event):
+        self._finish(event, None)
+
+
+_listener = None
+
+
+def register_mongo_listener():
+    """Register the command listener once per process (before any MongoClient is created)."""
+    global _listener
+    if _listener is None:
+        _listener = MongoCommandListener()
+        monitoring.register(_listener)
+    return _listener
+
+
+def start(scope, capture=False):
+    """Begin tracking on the current thread; pair with stop()."""
+    stats = QueryStats(scope, capture=capture)
+    if not hasattr(_local, 'active'):
+        _local.active = []
+    _local.active.append(stats)
+    return stats
+
+
+def stop(stats):
+    active = getattr(_local, 'active', [])
+    if stats in active:
+        active.remove(stats)
+    return stats
+
+
+def report(stats, threshold=N_PLUS_ONE_THRESHOLD):
+    """Record per-scope metrics and flag N+1 patterns."""
+    metrics.SCOPE_QUERIES.observe(stats.count, scope=stats.scope)
+    metrics.SCOPE_QUERY_TIME.observe(stats.total_ms / 1000.0, scope=stats.scope)
+    for shape, n in stats.repeated(threshold).items():
+        metrics.REPEATED_QUERIES.inc(scope=stats.scope)
+        print(f"⚠️ N+1 query pattern in {stats.scope}: {n}x {shape}")
+
+
+@contextmanager
+def track(scope, capture=False):
+    """Track queries issued inside the block (e.g. one background-job tick)."""
+    stats = start(scope, capture=capture)
+    try:
+        yield stats
+    finally:
+        stop(stats)
+        report(stats)
+
+
+@contextmanager
+def query_budget(max_queries=None, max_repeats=None, scope='budget'):
+    """
+    Fail (QueryBudgetExceeded) if the block issues more than max_queries
+    commands, or repeats any single query shape more than max_repeats times.
+
+    Raises QueryAccountingUnavailable instead of passing vacuously when no
+    command was ever observed: the listener isn't registered, or the client
+    doesn't emit command events (mongomock never does). Budgets need a real
+    mongod.
+    """
+    if _listener is None:
+        raise QueryAccountingUnavailable("no command listener registered (call register_mongo_listener first)")
+    stats = start(scope)
+    try:
+        yield stats
+    finally:
+        stop(stats)
+    if stats.count == 0 and _listener.events == 0:
+        raise QueryAccountingUnavailable(
+            "no MongoDB command events observed; the client doesn't report commands (mongomock?)")
+    if max_queries is not None and stats.count > max_queries:
+        raise QueryBudgetExceeded(
+            f"{stats.count} queries issued, budget is {max_queries}: {dict(stats.shapes)}")
+    if max_repeats is not None:
+        worst = stats.shapes.most_common(1)
+        if worst and worst[0][1] > max_repeats:
+            raise QueryBudgetExceeded(
+                f"query shape repeated {worst[0][1]}x (max {max_repeats}): {worst[0][0]}")
+
+
+# ---------------- FLASK INTEGRATION ----------------
+def _before_request():
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    g._query_stats = start(f"{request.method} {route}")
+
+
+def _after_request(response):
+    stats = g.get('_query_stats')
+    if stats is not None and current_app.config.get('QUERY_STATS_HEADER'):
+        # Server-Timing shows up in the browser devtools next to the request
+        response.headers['Server-Timing'] = f'db;dur={stats.total_ms:.2f};desc="{stats.count} queries"'
+    return response
+
+
+def _teardown_request(exc):
+    stats = g.pop('_query_stats', None)
+    if stats is not None:
+        stop(stats)
+        report(stats, current_app.config.get('N_PLUS_ONE_THRESHOLD', N_PLUS_ONE_THRESHOLD))
+
+
+def init_app(app):
+    listener = register_mongo_listener()
+    if app.config.get('METRICS_ENABLED', True):
+        listener.record_metrics = True
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
@@ -0,0 +1,96 @@
+"""
+Response encoding: a faster JSON provider and negotiated compression.
+
+- FastJSONProvider serializes with orjson when it is installed and falls back
+  to the stdlib provider otherwise. Either way datetimes come out as ISO 8601
+  (same as .isoformat()) and ObjectIds as strings, so routes can jsonify raw
+  pymongo documents without converting every field by hand.
+- Responses above COMPRESS_MIN_SIZE with a compressible mimetype are gzip- or
+  brotli-encoded (brotli only if the `brotli` package is installed) according
+  to the client's Accept-Encoding.
+"""
+import datetime
+import gzip
+
+from bson import ObjectId
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # optional
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'text/plain', 'text/html', 'text/csv', 'text/markdown')
+
+
+def _default(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    option = orjson.OPT_NON_STR_KEYS if orjson else 0
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            kwargs.setdefault('default', _default)
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=_default, option=self.option).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        # straight to bytes: no str round-trip
+        return self._app.response_class(
+            orjson.dumps(obj, default=_default, option=self.option | orjson.OPT_APPEND_NEWLINE),
+            mimetype=self.mimetype)
+
+
+# ---------------- COMPRESSION ----------------
+def _compress(response, min_size, gzip_level, brotli_quality):
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code < 200 or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    if len(data) < min_size:
+        return response
+
+    offered = ['br', 'gzip'] if brotli is not None else ['gzip']
+    encoding = request.accept_encodings.best_match(offered)
+    if encoding == 'br':
+        body = brotli.compress(data, quality=brotli_quality)
+    elif encoding == 'gzip':
+        body = gzip.compress(data, compresslevel=gzip_level, mtime=0)
+    else:
+        return response
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def init_app(app):
+    app.json = FastJSONProvider(app)
+    min_size = app.config.get('COMPRESS_MIN_SIZE', 1024)
+    if min_size is None:
+        return
+    gzip_level = app.config.get('COMPRESS_GZIP_LEVEL', 6)
+    brotli_quality = app.config.get('COMPRESS_BROTLI_QUALITY', 4)
+    app.after_request(lambda response: _compress(response, min_size, gzip_level, brotli_quality))
@@ -3,7 +3,7 @@
 from flask import Blueprint, request, jsonify
 from datetime import datetime, timedelta
 import threading, time
-from ..backend_app import db, genai, User, token_required
+from ..backend_app import db, get_genai, User, token_required
 
 # -----------------------------------
 # BLUEPRINT INITIALIZATION
@@ -87,7 +87,7 @@ Return the plan in markdown format with day-wise bullets.
     try:
         plan_text = None
         try:
-            model = genai.GenerativeModel("gemini-2.5")
+            model = get_genai().GenerativeModel("gemini-2.5")
             resp = model.generate_content(prompt)
             plan_text = (
                 resp.text.strip()
@@ -329,8 +329,5 @@ def planner_background_checker(interval=30):
     t = threading.Thread(target=run, daemon=True)
     t.start()
 
-# Start background checker
-try:
-    planner_background_checker(30)
-except Exception as e:
-    print("Planner checker failed to start:", e)
+# Background checker is opt-in (see backend_app.start_background_services);
+# call planner_background_checker() explicitly from the process that owns it.
@@ -0,0 +1,310 @@
+"""
+Vault blob storage.
+
+Files are addressed by a storage key, "ab/cd/<file_id><ext>", where ab/cd are
+the first hex digits of sha1(file_id). Two levels of 256 directories keep every
+directory small however many files the vault holds, and the same key works for
+the local and the S3-compatible backend.
+
+Text-heavy formats (COMPRESSIBLE_EXTS) are stored compressed with zstd when the
+`zstandard` package is installed, gzip otherwise; the codec is recorded as a
+suffix on the stored name (".zst" / ".gz"). save() callers record that suffix
+(File.storage_codec) and pass it back as `codec=` so a read is one lookup (one
+GET on S3); with codec=None (records from before it was stored) the backends
+probe each suffix.
+
+Keys that are absolute paths are File.storage_path values from before this
+module existed; they are read (and deleted) in place until migrate_storage.py
+has moved them.
+"""
+import gzip
+import hashlib
+import io
+import os
+import re
+import shutil
+import tempfile
+from contextlib import closing, contextmanager
+
+COMPRESSIBLE_EXTS = ('.txt', '.md', '.csv', '.json', '.text')
+
+try:
+    import zstandard
+except ImportError:  # optional
+    zstandard = None
+
+
+def shard_key(file_id, ext):
+    # ext comes from the client's filename: keep it to [.A-Za-z0-9] so the key
+    # never holds separators, backslashes or anything S3 would escape
+    ext = re.sub(r'[^.A-Za-z0-9]', '', ext).lower()
+    digest = hashlib.sha1(file_id.encode('utf-8')).hexdigest()
+    return f"{digest[:2]}/{digest[2:4]}/{file_id}{ext}"
+
+
+def is_legacy(key):
+    # legacy storage_path values are absolute paths; shard keys are always relative
+    return os.path.isabs(key)
+
+
+# ---------------- CODECS ----------------
+class _Codec:
+    suffix = ''
+
+    def compress_stream(self, src, dst):
+        shutil.copyfileobj(src, dst)
+
+    def open_reader(self, raw):
+        return raw
+
+
+class _Gzip(_Codec):
+    suffix = '.gz'
+
+    def compress_stream(self, src, dst):
+        # mtime=0 keeps the output deterministic for identical content
+        with gzip.GzipFile(fileobj=dst, mode='wb', compresslevel=6, mtime=0) as out:
+            shutil.copyfileobj(src, out)
+
+    def open_reader(self, raw):
+        return gzip.GzipFile(fileobj=raw, mode='rb')
+
+
+class _Zstd(_Codec):
+    suffix = '.zst'
+
+    def compress_stream(self, src, dst):
+        zstandard.ZstdCompressor(level=6).copy_stream(src, dst)
+
+    def open_reader(self, raw):
+        return zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+
+
+CODECS = {'.gz': _Gzip(), '.zst': _Zstd(), '': _Codec()}
+
+
+def pick_codec(compression):
+    if compression in (None, 'none', ''):
+        return None
+    if compression == 'zstd' or (compression == 'auto' and zstandard is not None):
+        if zstandard is None:
+            raise RuntimeError("VAULT_COMPRESSION=zstd requires the zstandard package")
+        return CODECS['.zst']
+    return CODECS['.gz']
+
+
+class _Counter(io.RawIOBase):
+    """Read-through wrapper counting the bytes that pass (original size of an upload)."""
+
+    def __init__(self, src):
+        self._src = src
+        self.count = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._src.read(len(buffer))
+        n = len(data)
+        buffer[:n] = data
+        self.count += n
+        return n
+
+
+# ---------------- BACKENDS ----------------
+class VaultStorage:
+    """Interface: save / open / delete / exists, plus local_path for parsers that need a file."""
+
+    def __init__(self, compression='auto'):
+        self.codec = pick_codec(compression)
+
+    def codec_for(self, key):
+        if self.codec is not None and os.path.splitext(key)[1].lower() in COMPRESSIBLE_EXTS:
+            return self.codec
+        return CODECS['']
+
+    def save(self, key, fileobj):
+        """Store fileobj under key; returns (original_size, stored_size)."""
+        raise NotImplementedError
+
+    def open(self, key, codec=None):
+        """Readable binary file object with the original (decompressed) content; FileNotFoundError if missing."""
+        raise NotImplementedError
+
+    def delete(self, key, codec=None):
+        raise NotImplementedError
+
+    def exists(self, key, codec=None):
+        raise NotImplementedError
+
+    def direct_path(self, key, codec=None):
+        """Local path holding the content verbatim (servable as-is), or None."""
+        if is_legacy(key):
+            return key if os.path.exists(key) else None
+        return None
+
+    @contextmanager
+    def local_path(self, key, codec=None):
+        """A local file with the original content; temporary if it has to be materialized."""
+        path = self.direct_path(key, codec)
+        if path:
+            yield path
+            return
+        ext = os.path.splitext(key)[1]
+        fd, tmp = tempfile.mkstemp(suffix=ext, prefix='mindvault-')
+        try:
+            with os.fdopen(fd, "wb") as out, closing(self.open(key, codec)) as src:
+                shutil.copyfileobj(src, out)
+            yield tmp
+        finally:
+            os.remove(tmp)
+
+
+class LocalStorage(VaultStorage):
+    def __init__(self, root, compression='auto'):
+        super().__init__(compression)
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _stored_path(self, key, codec=None):
+        """Existing stored file for key (whatever codec it was written with, if codec is None), or None."""
+        if is_legacy(key):
+            return key if os.path.exists(key) else None
+        base = os.path.join(self.root, *key.split('/'))
+        for suffix in (CODECS if codec is None else (codec,)):
+            if os.path.exists(base + suffix):
+                return base + suffix
+        return None
+
+    def save(self, key, fileobj):
+        codec = self.codec_for(key)
+        path = os.path.join(self.root, *key.split('/')) + codec.suffix
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        counter = _Counter(fileobj)
+        # write to a temp file in the same shard, then rename: readers never see partial blobs
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                codec.compress_stream(io.BufferedReader(counter), out)
+            os.replace(tmp, path)
+        except Exception:
+            os.remove(tmp)
+            raise
+        return counter.count, os.path.getsize(path)
+
+    def open(self, key, codec=None):
+        path = self._stored_path(key, codec)
+        if path is None:
+            raise FileNotFoundError(key)
+        reader = CODECS.get(os.path.splitext(path)[1], CODECS[''])
+        return reader.open_reader(open(path, 'rb'))
+
+    def delete(self, key, codec=None):
+        path = self._stored_path(key, codec)
+        if path is not None:
+            os.remove(path)
+
+    def exists(self, key, codec=None):
+        return self._stored_path(key, codec) is not None
+
+    def direct_path(self, key, codec=None):
+        path = self._stored_path(key, codec)
+        if path is not None and os.path.splitext(path)[1] not in ('.gz', '.zst'):
+            return path
+        return None
+
+
+class S3Storage(VaultStorage):
+    """
+    S3-compatible backend (AWS, MinIO, or a local stand-in such as moto_server:
+    set VAULT_S3_ENDPOINT). Needs boto3.
+    """
+
+    def __init__(self, bucket, prefix='', endpoint_url=None, compression='auto', client=None):
+        super().__init__(compression)
+        if client is None:
+            import boto3
+            client = boto3.client('s3', endpoint_url=endpoint_url)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+
+    def _object_key(self, key, suffix):
+        return f"{self.prefix}{key}{suffix}"
+
+    def _head(self, key, suffix):
+        from botocore.exceptions import ClientError
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._object_key(key, suffix))
+            return True
+        except ClientError as e:
+            if not _not_found(e):
+                raise
+            return False
+
+    def _find(self, key):
+        """Suffix the object was stored with, probing each codec (codec not recorded), or None."""
+        expected = self.codec_for(key).suffix
+        for suffix in [expected] + [s for s in CODECS if s != expected]:
+            if self._head(key, suffix):
+                return suffix
+        return None
+
+    def save(self, key, fileobj):
+        codec = self.codec_for(key)
+        counter = _Counter(fileobj)
+        # spool so large uploads don't sit in memory; boto3 handles multipart from here
+        with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as spool:
+            codec.compress_stream(io.BufferedReader(counter), spool)
+            stored = spool.tell()
+            spool.seek(0)
+            self.client.upload_fileobj(spool, self.bucket, self._object_key(key, codec.suffix))
+        return counter.count, stored
+
+    def open(self, key, codec=None):
+        from botocore.exceptions import ClientError
+        if is_legacy(key):
+            return open(key, 'rb')
+        suffix = self._find(key) if codec is None else codec
+        if suffix is None:
+            raise FileNotFoundError(key)
+        try:
+            body = self.client.get_object(Bucket=self.bucket, Key=self._object_key(key, suffix))['Body']
+        except ClientError as e:
+            if _not_found(e):
+                raise FileNotFoundError(key) from e
+            raise
+        return CODECS[suffix].open_reader(body)
+
+    def delete(self, key, codec=None):
+        if is_legacy(key):
+            if os.path.exists(key):
+                os.remove(key)
+            return
+        suffix = self._find(key) if codec is None else codec
+        if suffix is not None:
+            # DeleteObject succeeds on a missing key too
+            self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key, suffix))
+
+    def exists(self, key, codec=None):
+        if is_legacy(key):
+            return os.path.exists(key)
+        if codec is None:
+            return self._find(key) is not None
+        return self._head(key, codec)
+
+
+def _not_found(error):
+    return error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound')
+
+
+def from_config(config):
+    compression = config.get('VAULT_COMPRESSION', 'auto')
+    if config.get('VAULT_STORAGE', 'local') == 's3':
+        return S3Storage(
+            bucket=config['VAULT_S3_BUCKET'],
+            prefix=config.get('VAULT_S3_PREFIX') or '',
+            endpoint_url=config.get('VAULT_S3_ENDPOINT'),
+            compression=compression,
+        )
+    return LocalStorage(config['VAULT_FOLDER'], compression=compression)
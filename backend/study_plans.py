@@ -0,0 +1,132 @@
+"""
+Structured AI study plans.
+
+The model is asked for JSON Lines, one day per line:
+
+    {"day": 1, "focus": "Limits", "tasks": [{"title": "Read 2.1", "details": "..."}]}
+
+so DayStreamParser can turn each day into planner records as soon as its line
+has streamed in, instead of waiting for (and re-parsing) one large document.
+"""
+import hashlib
+import json
+import re
+
+MAX_DAYS = 60
+MAX_TASKS_PER_DAY = 10
+MAX_TEXT = 500
+
+
+def normalize_text(value):
+    return re.sub(r'\s+', ' ', (value or '').strip().lower())
+
+
+def normalize_subjects(value):
+    """'Physics, maths;  Physics' -> 'maths,physics' (order and duplicates don't matter)."""
+    parts = {normalize_text(p) for p in re.split(r'[,;/\n]', value or '')}
+    return ','.join(sorted(p for p in parts if p))
+
+
+def plan_cache_key(mode, goals, subjects, timeframe):
+    normalized = [mode, normalize_text(goals), normalize_subjects(subjects), normalize_text(timeframe)]
+    return hashlib.sha256(json.dumps(normalized).encode('utf-8')).hexdigest()
+
+
+def structured_prompt(goals, subjects, timeframe):
+    return (
+        "You are an expert study planner. Create a clear, actionable study plan.\n\n"
+        f"Goals: {goals}\nSubjects: {subjects}\nTimeframe: {timeframe}\n\n"
+        "Respond in JSON Lines only: one JSON object per line, one line per day, no prose, "
+        "no code fences. Each line must match:\n"
+        '{"day": <day number starting at 1>, "focus": "<short theme>", '
+        '"tasks": [{"title": "<short task>", "details": "<one sentence>"}]}\n'
+        f"Use at most {MAX_DAYS} days and {MAX_TASKS_PER_DAY} tasks per day."
+    )
+
+
+def _clean_text(value):
+    return value.strip()[:MAX_TEXT] if isinstance(value, str) else ''
+
+
+def normalize_day(raw):
+    """Validate one parsed day; returns None if it is unusable."""
+    if not isinstance(raw, dict):
+        return None
+    try:
+        day = int(raw.get('day'))
+    except (TypeError, ValueError):
+        return None
+    if not 1 <= day <= MAX_DAYS:
+        return None
+    tasks = []
+    for task in (raw.get('tasks') or [])[:MAX_TASKS_PER_DAY]:
+        if isinstance(task, str):
+            task = {'title': task}
+        title = _clean_text(task.get('title')) if isinstance(task, dict) else ''
+        if title:
+            tasks.append({'title': title, 'details': _clean_text(task.get('details'))})
+    return {'day': day, 'focus': _clean_text(raw.get('focus')) or f"Day {day}", 'tasks': tasks}
+
+
+class DayStreamParser:
+    """
+    Feed streamed text chunks; complete days come back from feed() as soon as
+    their line is finished. finish() flushes the last line and, if the model
+    ignored the JSON Lines format, falls back to parsing the whole response as
+    a JSON array or {"days": [...]} object.
+    """
+
+    def __init__(self):
+        self._buffer = ''
+        self._raw = []
+        self._seen = set()
+
+    def _parse_line(self, line):
+        line = line.strip().rstrip(',')
+        if not line.startswith('{'):
+            return None
+        try:
+            day = normalize_day(json.loads(line))
+        except ValueError:
+            return None
+        if day is None or day['day'] in self._seen:
+            return None
+        self._seen.add(day['day'])
+        return day
+
+    def feed(self, chunk):
+        self._raw.append(chunk)
+        self._buffer += chunk
+        *lines, self._buffer = self._buffer.split('\n')
+        return [day for day in map(self._parse_line, lines) if day]
+
+    def finish(self):
+        days = [day for day in [self._parse_line(self._buffer)] if day]
+        self._buffer = ''
+        if self._seen:
+            return days
+        text = ''.join(self._raw).strip()
+        text = re.sub(r'^```(?:json)?|```$', '', text).strip()
+        try:
+            doc = json.loads(text)
+        except ValueError:
+            return days
+        if isinstance(doc, dict):
+            doc = doc.get('days') or []
+        for raw in doc if isinstance(doc, list) else []:
+            day = normalize_day(raw)
+            if day and day['day'] not in self._seen:
+                self._seen.add(day['day'])
+                days.append(day)
+        return days
+
+
+def render_markdown(days):
+    """Readable version of a structured plan, stored as AIPlan.plan_text."""
+    lines = ["### Study Plan", ""]
+    for day in sorted(days, key=lambda d: d['day']):
+        lines.append(f"**Day {day['day']}: {day['focus']}**")
+        for task in day['tasks']:
+            lines.append(f"- {task['title']}" + (f" — {task['details']}" if task['details'] else ''))
+        lines.append("")
+    return "\n".join(lines).strip()
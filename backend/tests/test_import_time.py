@@ -0,0 +1,50 @@
+"""
+Importing backend_app must stay cheap: the PDF / PowerPoint parsers and the
+Gemini SDK are imported lazily, on first use (see get_genai / _extract_pages).
+
+    cd backend
+    python -m pytest -q tests
+"""
+import json
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ('fitz', 'pptx', 'google.generativeai')
+# generous for slow CI machines; a heavy import at module level costs more than this on its own
+BUDGET_MS = float(os.getenv('IMPORT_TIME_BUDGET_MS') or 1500)
+
+
+def _import_backend_app():
+    script = (
+        "import json, sys, backend_app; "
+        f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))"
+    )
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', script],
+        cwd=BACKEND_DIR, capture_output=True, text=True, timeout=120,
+    )
+    assert proc.returncode == 0, proc.stderr[-2000:]
+    return proc
+
+
+def _cumulative_ms(importtime_log, module):
+    # lines look like "import time:  self [us] | cumulative | module"
+    for line in importtime_log.splitlines():
+        parts = [p.strip() for p in line.split('|')]
+        if len(parts) == 3 and parts[2] == module:
+            return int(parts[1]) / 1000.0
+    raise AssertionError(f"{module} not found in -X importtime output")
+
+
+def test_heavy_modules_are_not_imported():
+    proc = _import_backend_app()
+    loaded = json.loads(proc.stdout.strip().splitlines()[-1])
+    assert loaded == [], f"imported at module level: {loaded}"
+
+
+def test_import_time_budget():
+    proc = _import_backend_app()
+    elapsed_ms = _cumulative_ms(proc.stderr, 'backend_app')
+    assert elapsed_ms < BUDGET_MS, f"import backend_app took {elapsed_ms:.0f} ms (budget {BUDGET_MS:.0f} ms)"
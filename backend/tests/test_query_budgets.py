@@ -0,0 +1,169 @@
+"""
+Query budgets for the hot paths, measured by the pymongo command listener.
+
+mongomock doesn't emit command events, so the budgets run against a real
+mongod and are skipped unless MONGO_TEST_URI points at one:
+
+    cd backend
+    MONGO_TEST_URI=mongodb://localhost:27017 python -m pytest -q tests
+
+Each run uses a throwaway database that is dropped afterwards.
+"""
+import datetime
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+import query_accounting  # noqa: E402
+from query_accounting import QueryAccountingUnavailable, query_budget  # noqa: E402
+
+MONGO_TEST_URI = os.getenv('MONGO_TEST_URI')
+
+
+def _mongod_reachable(uri):
+    from pymongo import MongoClient
+    from pymongo.errors import PyMongoError
+    client = MongoClient(uri, serverSelectionTimeoutMS=2000)
+    try:
+        client.admin.command('ping')
+        return True
+    except PyMongoError:
+        return False
+    finally:
+        client.close()
+
+
+requires_mongod = pytest.mark.skipif(
+    not MONGO_TEST_URI or not _mongod_reachable(MONGO_TEST_URI),
+    reason="set MONGO_TEST_URI to a reachable mongod to run query budgets")
+
+
+def test_budget_fails_loudly_without_listener(monkeypatch):
+    monkeypatch.setattr(query_accounting, '_listener', None)
+    with pytest.raises(QueryAccountingUnavailable):
+        with query_budget(max_queries=1):
+            pass
+
+
+def test_budget_fails_loudly_without_command_events(monkeypatch):
+    mongomock = pytest.importorskip('mongomock')
+    monkeypatch.setattr(query_accounting, '_listener', query_accounting.MongoCommandListener())
+    collection = mongomock.MongoClient().db.things
+    with pytest.raises(QueryAccountingUnavailable):
+        with query_budget(max_queries=1):
+            collection.insert_one({'a': 1})
+            list(collection.find({'a': 1}))
+
+
+# ---------------- REAL MONGOD ----------------
+@pytest.fixture(scope='module')
+def app():
+    import mongoengine
+    from backend_app import create_app
+
+    db_name = f"mindvault_budget_{uuid.uuid4().hex[:12]}"
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app({
+            'MONGODB_SETTINGS': {'host': MONGO_TEST_URI, 'db': db_name},
+            'VAULT_FOLDER': os.path.join(tmp, 'vault'),
+            'DERIVED_FOLDER': os.path.join(tmp, 'derived'),
+            'BCRYPT_ROUNDS': 4,
+        }, start_background=False)
+        try:
+            yield app
+        finally:
+            with app.app_context():
+                from backend_app import User
+                User._get_db().client.drop_database(db_name)
+            mongoengine.disconnect_all()
+
+
+@pytest.fixture
+def user(app):
+    import jwt
+    from backend_app import PlannerEvent, PlannerTask, User
+
+    with app.app_context():
+        u = User(firstName='budget', email=f"{uuid.uuid4().hex}@example.com", password='x').save()
+        token = jwt.encode({'user_id': str(u.id)}, app.config['JWT_SECRET'], algorithm='HS256')
+        yield u, {'Authorization': f'Bearer {token}'}
+        PlannerTask.objects(user_id=u).delete()
+        PlannerEvent.objects(user_id=u).delete()
+        u.delete()
+
+
+def _events(user, n, deadline):
+    from backend_app import PlannerEvent
+    PlannerEvent._get_collection().insert_many([
+        {'user_id': user.id, 'title': f'event {i}', 'deadline': deadline,
+         'created_at': deadline, 'updated_at': deadline}
+        for i in range(n)])
+
+
+@requires_mongod
+def test_get_alerts_budget(app, user):
+    from backend_app import alerts_cache
+    u, headers = user
+    with app.app_context():
+        _events(u, 30, datetime.datetime.utcnow() - datetime.timedelta(hours=1))
+    client = app.test_client()
+    assert client.get('/api/planner/alerts', headers=headers).status_code == 200  # warm up
+    alerts_cache.invalidate(str(u.id))
+    # token_required's user lookup + one range scan, however many events
+    with query_budget(max_queries=2, max_repeats=1):
+        response = client.get('/api/planner/alerts', headers=headers)
+    assert response.status_code == 200
+    assert len(response.get_json()['alerts']) == 30
+
+
+@requires_mongod
+def test_check_planner_deadlines_budget_is_flat(app, user):
+    from backend_app import Alert, check_planner_deadlines
+    u, _ = user
+    now = datetime.datetime.utcnow()
+    counts = []
+    with app.app_context():
+        check_planner_deadlines(now=now)  # warm up
+        for n in (5, 60):
+            Alert.objects(user_id=u).delete()
+            _events(u, n, now - datetime.timedelta(minutes=n))
+            # find expired + distinct already-alerted + one insert_many
+            with query_budget(max_queries=3, max_repeats=1) as stats:
+                since = check_planner_deadlines(now=now)
+            counts.append(stats.count)
+            # nothing changed since the last tick: one empty find
+            with query_budget(max_queries=1):
+                check_planner_deadlines(now=now, since=since)
+        Alert.objects(user_id=u).delete()
+    assert counts[0] == counts[1]
+
+
+@requires_mongod
+def test_bulk_planner_budget(app, user):
+    from backend_app import PlannerEvent, PlannerTask
+    u, headers = user
+    with app.app_context():
+        tasks = [PlannerTask(user_id=u, title=f'task {i}').save() for i in range(20)]
+        events = [PlannerEvent(user_id=u, title=f'event {i}',
+                               deadline=datetime.datetime.utcnow()).save() for i in range(20)]
+    operations = (
+        [{'op': 'create', 'kind': 'task', 'data': {'title': f'new {i}'}} for i in range(20)]
+        + [{'op': 'update', 'kind': 'task', 'id': str(t.id), 'data': {'done': True}} for t in tasks[:10]]
+        + [{'op': 'delete', 'kind': 'task', 'id': str(t.id)} for t in tasks[10:]]
+        + [{'op': 'update', 'kind': 'event', 'id': str(e.id), 'data': {'title': 'moved'}} for e in events[:10]]
+        + [{'op': 'delete', 'kind': 'event', 'id': str(e.id)} for e in events[10:]]
+    )
+    client = app.test_client()
+    # user lookup + one existence check per collection + one bulk_write per
+    # collection (tasks, events, tombstones), independent of the batch size
+    with query_budget(max_queries=6, max_repeats=2):
+        response = client.post('/api/planner/bulk', headers=headers, json={'operations': operations})
+    assert response.status_code == 200
+    assert response.get_json()['ok'] is True
@@ -0,0 +1,107 @@
+"""
+S3Storage against moto's in-process S3 (boto3 client passed as client=).
+
+    cd backend
+    python -m pytest -q tests
+"""
+import io
+import os
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+boto3 = pytest.importorskip('boto3')
+moto = pytest.importorskip('moto')
+
+import storage  # noqa: E402
+
+BUCKET = 'mindvault-test'
+
+
+@pytest.fixture
+def s3_client(monkeypatch):
+    for name in ('AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY', 'AWS_SECURITY_TOKEN', 'AWS_SESSION_TOKEN'):
+        monkeypatch.setenv(name, 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    with moto.mock_aws():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+@pytest.fixture
+def calls(s3_client):
+    """Names of the S3 API calls made through the client, in order."""
+    seen = []
+    s3_client.meta.events.register('before-call.s3', lambda model, **_: seen.append(model.name))
+    return seen
+
+
+def _store(client, compression='gzip'):
+    return storage.S3Storage(BUCKET, prefix='vault', compression=compression, client=client)
+
+
+def _objects(client):
+    return [o['Key'] for o in client.list_objects_v2(Bucket=BUCKET).get('Contents', [])]
+
+
+def test_save_open_exists_delete(s3_client):
+    store = _store(s3_client)
+    key = storage.shard_key('f1', '.pdf')
+    assert store.save(key, io.BytesIO(b'%PDF-1.4 data')) == (13, 13)
+    assert _objects(s3_client) == [f'vault/{key}']
+    assert store.exists(key) and store.exists(key, '')
+    with store.open(key, '') as f:
+        assert f.read() == b'%PDF-1.4 data'
+    store.delete(key, '')
+    assert not store.exists(key)
+    assert _objects(s3_client) == []
+
+
+def test_compressed_text_round_trip(s3_client):
+    store = _store(s3_client)
+    key = storage.shard_key('f2', '.txt')
+    text = b'lecture notes\n' * 1000
+    codec = store.codec_for(key).suffix
+    assert codec == '.gz'
+    original, stored = store.save(key, io.BytesIO(text))
+    assert original == len(text) and stored < original
+    assert _objects(s3_client) == [f'vault/{key}.gz']
+    # recorded codec or probed: same content
+    for hint in (codec, None):
+        with store.open(key, hint) as f:
+            assert f.read() == text
+    with store.local_path(key, codec) as path:
+        with open(path, 'rb') as f:
+            assert f.read() == text
+
+
+def test_recorded_codec_reads_with_one_request(s3_client, calls):
+    store = _store(s3_client)
+    key = storage.shard_key('f3', '.txt')
+    store.save(key, io.BytesIO(b'hello'))
+    del calls[:]
+    store.open(key, '.gz').read()
+    assert calls == ['GetObject']
+    del calls[:]
+    assert store.exists(key, '.gz')
+    assert calls == ['HeadObject']
+    del calls[:]
+    store.delete(key, '.gz')
+    assert calls == ['DeleteObject']
+
+
+def test_missing_object(s3_client):
+    store = _store(s3_client)
+    key = storage.shard_key('missing', '.pdf')
+    assert not store.exists(key)
+    assert not store.exists(key, '')
+    with pytest.raises(FileNotFoundError):
+        store.open(key)
+    with pytest.raises(FileNotFoundError):
+        store.open(key, '')
+    store.delete(key)
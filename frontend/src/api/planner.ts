@@ -59,6 +59,41 @@ export const fetchEvents = async () => {
   return res.data;
 };
 
+export const deleteEvent = async (id: string) => {
+  const res = await axiosInstance.delete(`/events/${id}`);
+  return res.data;
+};
+
+// ------------------- DELTA SYNC -------------------
+// Pass the token from the previous call to receive only changed tasks/events
+// and deleted ids; reset=true means the lists are complete snapshots.
+export const syncPlanner = async (since?: string | null) => {
+  const res = await axiosInstance.get("/sync", {
+    params: since ? { since } : {},
+  });
+  return res.data as {
+    tasks: { id: string; title: string; details?: string; done: boolean }[];
+    events: { id: string; title: string; description?: string; deadline: string }[];
+    deleted: { tasks: string[]; events: string[] };
+    reset: boolean;
+    token: string;
+  };
+};
+
+// ------------------- BULK -------------------
+export type PlannerBulkOp =
+  | { op: "create"; kind: "task" | "event"; data: Record<string, unknown> }
+  | { op: "update"; kind: "task" | "event"; id: string; data: Record<string, unknown> }
+  | { op: "delete"; kind: "task" | "event"; id: string };
+
+export const bulkPlanner = async (operations: PlannerBulkOp[]) => {
+  const res = await axiosInstance.post("/bulk", { operations });
+  return res.data as {
+    ok: boolean;
+    results: { index: number; ok: boolean; id?: string; error?: string }[];
+  };
+};
+
 // ------------------- DEADLINES -------------------
 export const fetchUpcomingDeadlines = async () => {
   const res = await axiosInstance.get("/upcoming-deadlines");
@@ -81,6 +116,8 @@ export const generateAIPlan = async (data: {
   goals?: string;
   subjects?: string;
   timeframe?: string;
+  mode?: "markdown" | "structured";
+  start_date?: string;
 }) => {
   // Always ensure an object is passed
   if (!data || typeof data !== "object") {